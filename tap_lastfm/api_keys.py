@@ -0,0 +1,140 @@
+"""Spreading requests to the Last.fm API across several API keys."""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from tap_lastfm.rate_limit import RateLimiter
+
+# how long to stop using a key which Last.fm reported invalid or suspended
+REJECTED_BENCH_SECONDS = 600
+# and one whose rate limit was exceeded, in favour of the other keys
+RATE_LIMITED_BENCH_SECONDS = 30
+
+
+class APIKey:
+    """An API key, with its own rate limit and counts of how it was used."""
+
+    def __init__(self, value: str, limiter: RateLimiter) -> None:
+        """Create a key whose requests are limited by `limiter`."""
+        self.value = value
+        self.limiter = limiter
+        self.benched_until = 0.0
+        self.rejected_until = 0.0
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.rejected_count = 0
+
+    @property
+    def label(self) -> str:
+        """Return a name for the key which does not give it away, for logs."""
+        return f"API key ...{self.value[-4:]}"
+
+
+class KeyPool:
+    """Spreads requests across API keys, each with its own rate limit.
+
+    Each request is sent with the key which can send it soonest, or the least
+    used of those. A key which Last.fm rejects, or whose rate limit was
+    exceeded, is benched for a while: it is only used again before then if
+    every key is benched, so that the other keys take its requests. With a
+    single key, nothing is benched and the key is only slowed down.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        max_rate: float,
+        burst: int = 1,
+        logger: Optional[logging.Logger] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Create a pool of keys, each allowing `max_rate` requests per second.
+
+        Duplicate keys are ignored. Each key may send `burst` requests back to
+        back. Rates and usage are reported to `logger`, if given; `clock` and
+        `sleep` stand in for monotonic time and waiting.
+        """
+        values = list(dict.fromkeys(keys))
+        if not values:
+            raise ValueError("At least one API key is required")
+        self.keys: List[APIKey] = []
+        for value in values:
+            limiter = RateLimiter(
+                max_rate, burst, logger=logger, clock=clock, sleep=sleep
+            )
+            key = APIKey(value, limiter)
+            if len(values) > 1:
+                # tell the keys apart in the limiters' reports
+                limiter.name = key.label
+            self.keys.append(key)
+        self._by_value: Dict[str, APIKey] = {k.value: k for k in self.keys}
+        self._logger = logger
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[str, float]:
+        """Wait until a request may be sent with one of the keys.
+
+        Returns the key to send the request with, and the time waited.
+        """
+        with self._lock:
+            now = self._clock()
+            available = [k for k in self.keys if k.benched_until <= now]
+            if available:
+                key = min(
+                    available, key=lambda k: (k.limiter.wait_time(), k.request_count)
+                )
+            else:
+                key = min(self.keys, key=lambda k: k.benched_until)
+            key.request_count += 1
+        return key.value, key.limiter.acquire()
+
+    def succeeded(self, value: str) -> None:
+        """Recover some of a key's request rate after a successful request."""
+        self._by_value[value].limiter.succeeded()
+
+    def rate_limited(self, value: str) -> None:
+        """Slow down and bench a key whose rate limit was exceeded."""
+        key = self._by_value[value]
+        with self._lock:
+            key.rate_limited_count += 1
+        key.limiter.throttled()
+        self._bench(key, RATE_LIMITED_BENCH_SECONDS)
+
+    def rejected(self, value: str) -> bool:
+        """Bench a key which Last.fm reported invalid or suspended.
+
+        Returns whether any other key has not been rejected as well.
+        """
+        key = self._by_value[value]
+        with self._lock:
+            key.rejected_count += 1
+            now = self._clock()
+            key.rejected_until = now + REJECTED_BENCH_SECONDS
+            usable = any(k.rejected_until <= now for k in self.keys if k is not key)
+        self._bench(key, REJECTED_BENCH_SECONDS)
+        return usable
+
+    def log_summary(self) -> None:
+        """Report the request rate and usage of each key over the whole run."""
+        for key in self.keys:
+            key.limiter.log_summary()
+        if not self._logger or len(self.keys) == 1:
+            return
+        for key in self.keys:
+            self._logger.info(
+                f"{key.label}: sent {key.request_count} requests, "
+                f"{key.rate_limited_count} were rate limited and "
+                f"{key.rejected_count} rejected"
+            )
+
+    def _bench(self, key: APIKey, seconds: float) -> None:
+        if len(self.keys) == 1:
+            return
+        with self._lock:
+            key.benched_until = self._clock() + seconds
+        if self._logger:
+            self._logger.warning(f"Not using {key.label} for {seconds}s")
@@ -0,0 +1,118 @@
+"""An on-disk cache of API responses which will not change."""
+
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+
+
+class ResponseCache:
+    """A size-bounded SQLite store of compressed response bodies.
+
+    Entries are evicted least recently used first once the total compressed
+    size exceeds `max_bytes`. The cache may be shared between threads.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        refresh: bool = False,
+        logger: Optional[logging.Logger] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Open or create the cache at `path`.
+
+        At most `max_bytes` of compressed responses are kept. With `refresh`,
+        responses are only stored, so that every response already stored is
+        requested again and replaced. How much the cache was used is reported
+        to `logger`, if given; `clock` gives the time entries were last used.
+        """
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self._logger = logger
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, body BLOB NOT NULL, "
+            "size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses(used)")
+        self._db.commit()
+        (size,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self.size = size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the body stored for `key`, or `None` if there is none."""
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (self._clock(), key)
+            )
+            self._db.commit()
+            self.hits += 1
+        return zlib.decompress(row[0])
+
+    def put(self, key: str, body: bytes) -> None:
+        """Store `body` for `key`, evicting old entries if the cache is full."""
+        compressed = zlib.compress(body)
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "REPLACE INTO responses (key, body, size, used) VALUES (?, ?, ?, ?)",
+                (key, compressed, len(compressed), self._clock()),
+            )
+            self.size += len(compressed) - (previous[0] if previous else 0)
+            self.stored += 1
+            self._evict()
+            self._db.commit()
+
+    def close(self) -> None:
+        """Report on the cache's use and close it."""
+        if self._logger:
+            self._logger.info(
+                f"Response cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.stored} stored, {self.evicted} evicted, "
+                f"{self.size / 2**20:.1f} MiB in use"
+            )
+        with self._lock:
+            self._db.close()
+
+    def _evict(self) -> None:
+        if self.size <= self.max_bytes:
+            return
+        # make some room, so that not every new entry has to evict another
+        target = self.max_bytes * 0.9
+        while self.size > target:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY used LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                self.evicted += 1
+                if self.size <= target:
+                    break
@@ -1,36 +1,122 @@
 """REST client handling, including LastFMStream base class."""
 
-from typing import Any, Callable, Dict, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    cast,
+)
+from urllib.parse import parse_qs, urlsplit
 
 import backoff
 import requests
-from singer_sdk.authenticators import APIKeyAuthenticator
-from singer_sdk.exceptions import RetriableAPIError
+from singer_sdk.exceptions import FatalAPIError, RetriableAPIError
 from singer_sdk.helpers.jsonpath import extract_jsonpath
 
+from tap_lastfm.api_keys import KeyPool
+from tap_lastfm.cache import ResponseCache
+from tap_lastfm.concurrency import ordered_map
+from tap_lastfm.metrics import (
+    BACKOFF,
+    BYTES_RECEIVED,
+    DECODE,
+    EMIT,
+    MAPPING,
+    NETWORK,
+    RATE_LIMIT,
+    RECORDS,
+    RETRIES,
+    Metrics,
+)
+from tap_lastfm.output import BufferedOutputStream
 from tap_lastfm.property_stream import PropertyStream
 
+if TYPE_CHECKING:
+    from tap_lastfm.tap import TapLastFM
 
-class LastFMStream(PropertyStream):
+# https://www.last.fm/api/errorcodes
+USER_NOT_FOUND = 6
+OPERATION_FAILED = 8
+INVALID_API_KEY = 10
+SERVICE_OFFLINE = 11
+TEMPORARILY_UNAVAILABLE = 16
+SUSPENDED_API_KEY = 26
+RATE_LIMIT_EXCEEDED = 29
+# errors which may not happen again if the request is retried
+TRANSIENT_ERRORS = (OPERATION_FAILED, SERVICE_OFFLINE, TEMPORARILY_UNAVAILABLE)
+
+# where the decoded body is kept on a response
+DECODED_BODY = "_tap_lastfm_body"
+
+
+def cached_response(body: bytes) -> requests.Response:
+    """Return a successful response with the given body."""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.encoding = "utf-8"
+    return response
+
+
+def api_key_of(request: requests.PreparedRequest) -> Optional[str]:
+    """Return the API key a request was sent with, if any."""
+    values = parse_qs(urlsplit(request.url or "").query).get("api_key")
+    return values[0] if values else None
+
+
+def bytes_received(response: requests.Response) -> int:
+    """Return the size of a response's body as sent, before decompression."""
+    if response.raw is not None and hasattr(response.raw, "tell"):
+        return response.raw.tell()
+    return len(response.content)
+
+
+class LastFMAPIError(FatalAPIError):
+    """An error reported by Last.fm in the body of a response."""
+
+    def __init__(self, code: int, message: str) -> None:
+        """Create an error with the Last.fm error code and message."""
+        super().__init__(f"Last.fm error {code}: {message}")
+        self.code = code
+
+
+class LastFMStream(BufferedOutputStream, PropertyStream):
     """LastFM base stream class."""
 
-    url_base = "http://ws.audioscrobbler.com"
+    url_base = "https://ws.audioscrobbler.com"
     # path is the same for all endpoints, they are chosen via the 'method' query param
     path = "/2.0"
     # Override this to return the method name to access
     method: str
     records_jsonpath = "$[*]"
     total_pages_jsonpath: Optional[str] = None
+    total_records_jsonpath: Optional[str] = None
+
+    _metrics_partition: Optional[str] = None
 
     @property
-    def authenticator(self) -> APIKeyAuthenticator:
-        """Return a new authenticator object."""
-        return APIKeyAuthenticator.create_for_stream(
-            self,
-            key="api_key",
-            value=str(self.config.get("api_key")),
-            location="params",
-        )
+    def requests_session(self) -> requests.Session:
+        """Return the HTTP session shared by every stream and worker thread."""
+        return cast("TapLastFM", self._tap).requests_session
+
+    @property
+    def api_keys(self) -> KeyPool:
+        """Return the API keys shared by every stream and worker thread."""
+        return cast("TapLastFM", self._tap).api_keys
+
+    @property
+    def metrics(self) -> Metrics:
+        """Return the collector of timings shared by every stream and thread."""
+        return cast("TapLastFM", self._tap).metrics
+
+    @property
+    def response_cache(self) -> Optional[ResponseCache]:
+        """Return the on-disk response cache, if one is configured."""
+        return cast("TapLastFM", self._tap).response_cache
 
     @property
     def http_headers(self) -> dict:
@@ -40,30 +126,109 @@ class LastFMStream(PropertyStream):
             headers["User-Agent"] = self.config.get("user_agent")
         return headers
 
-    def get_next_page_token(
-        self, response: requests.Response, previous_token: Optional[int]
-    ) -> Optional[int]:
-        """Return a token for identifying next page or None if no more pages."""
+    def get_total_pages(self, response: requests.Response) -> int:
+        """Return the number of pages reported by the response, or 0 if unknown."""
         if not self.total_pages_jsonpath:
-            return None
-        if not previous_token:
-            return 2  # we already requested page 1
-
-            # TODO: I think this is confusing design for the SDK.
-            # The first time `get_next_page_token` is called is after
-            # the first request. Often pagination logic is split between
-            # `get_next_page_token` and `get_url_params` which needs to know
-            # how to set up the first page.
-            # Also `get_next_page_token` should maybe have access to context.
-
-        total_pages = int(
-            next(iter(extract_jsonpath(self.total_pages_jsonpath, response.json())), 0)
+            return 0
+        return int(
+            next(
+                iter(
+                    extract_jsonpath(
+                        self.total_pages_jsonpath, self.decode_response(response)
+                    )
+                ),
+                0,
+            )
         )
 
-        next_token = previous_token + 1
-        if next_token > total_pages:
-            return None
-        return next_token
+    def request_page(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> requests.Response:
+        """Request a single page, retrying on failure.
+
+        Pages which can be cached are read from the response cache if present
+        there, and stored in it otherwise.
+        """
+        cache = self.response_cache
+        cache_key = self.get_cache_key(context, next_page_token) if cache else None
+        if cache and cache_key:
+            body = cache.get(cache_key)
+            if body is not None:
+                return cached_response(body)
+        prepared_request = self.prepare_request(context, next_page_token)
+        decorated_request = self.request_decorator(self._request)
+        response = decorated_request(prepared_request, context)
+        if cache and cache_key:
+            cache.put(cache_key, response.content)
+        return response
+
+    def get_cache_key(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> Optional[str]:
+        """Return the key to cache a page under, or None if it may change.
+
+        Streams whose past pages never change should override this.
+        """
+        return None
+
+    def request_pages(
+        self, context: Optional[dict], page_tokens: Iterable[Any]
+    ) -> Iterator[requests.Response]:
+        """Request several pages, in parallel if configured, in order."""
+        max_concurrent_pages = self.config.get("max_concurrent_pages", 1)
+        if max_concurrent_pages <= 1:
+            return (self.request_page(context, t) for t in page_tokens)
+        return ordered_map(
+            cast("TapLastFM", self._tap).page_executor,
+            lambda t: self.request_page(context, t),
+            page_tokens,
+            limit=max_concurrent_pages,
+        )
+
+    def get_total_records(self, response: requests.Response) -> int:
+        """Return the number of records across all pages, or 0 if unknown."""
+        if not self.total_records_jsonpath:
+            return 0
+        return int(
+            next(
+                iter(
+                    extract_jsonpath(
+                        self.total_records_jsonpath, self.decode_response(response)
+                    )
+                ),
+                0,
+            )
+        )
+
+    def decode_response(self, response: requests.Response) -> Any:
+        """Return the decoded JSON body of the response.
+
+        The body is decoded once and kept on the response, as it is read for
+        errors, records and pagination.
+        """
+        if DECODED_BODY not in response.__dict__:
+            with self.metrics.timer(DECODE, self.name):
+                response.__dict__[DECODED_BODY] = response.json()
+        return response.__dict__[DECODED_BODY]
+
+    def parse_response(self, response: requests.Response) -> Iterable[dict]:
+        """Parse the response and return an iterator of result rows."""
+        yield from extract_jsonpath(
+            self.records_jsonpath, input=self.decode_response(response)
+        )
+
+    def post_process(self, row: dict, context: Optional[dict] = None) -> Optional[dict]:
+        """Remap and cast properties by jsonpath."""
+        self._metrics_partition = self.get_metrics_partition(context)
+        with self.metrics.timer(MAPPING, self.name, self._metrics_partition):
+            return super().post_process(row, context)
+
+    def _write_record_message(self, record: dict) -> None:
+        # records are written straight after they are post-processed
+        partition = self._metrics_partition
+        with self.metrics.timer(EMIT, self.name, partition):
+            super()._write_record_message(record)
+        self.metrics.count(RECORDS, 1, (self.name, partition))
 
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[int]
@@ -79,6 +244,70 @@ class LastFMStream(PropertyStream):
             params["user"] = context["username"]
         return params
 
+    def _request(
+        self, prepared_request: requests.PreparedRequest, context: Optional[dict]
+    ) -> requests.Response:
+        partition = self.get_metrics_partition(context)
+        api_key, waited = self.api_keys.acquire()
+        self.metrics.add_time(RATE_LIMIT, waited, (self.name, partition))
+        # each attempt is sent with whichever key can send it soonest
+        request = prepared_request.copy()
+        request.prepare_url(request.url, {"api_key": api_key})
+        with self.metrics.timer(NETWORK, self.name, partition):
+            response = super()._request(request, context)
+        self.metrics.count(
+            BYTES_RECEIVED, bytes_received(response), (self.name, partition)
+        )
+        self.api_keys.succeeded(api_key)
+        return response
+
+    def get_metrics_partition(self, context: Optional[dict]) -> Optional[str]:
+        """Return the name of the partition to record timings under."""
+        return context.get("username") if context else None
+
+    def backoff_handler(self, details: dict) -> None:
+        """Log and count the retry about to be made."""
+        super().backoff_handler(details)
+        context = details["args"][1] if len(details["args"]) > 1 else None
+        key = (self.name, self.get_metrics_partition(context))
+        self.metrics.count(RETRIES, 1, key)
+        self.metrics.add_time(BACKOFF, details["wait"], key)
+
+    def get_error_code(self, response: requests.Response) -> Optional[int]:
+        """Return the Last.fm error code from the response body, if any."""
+        try:
+            body = self.decode_response(response)
+        except ValueError:
+            return None
+        if not isinstance(body, dict) or "error" not in body:
+            return None
+        return int(body["error"])
+
+    def validate_response(self, response: requests.Response) -> None:
+        """Validate HTTP response, including errors reported in the body."""
+        code = self.get_error_code(response)
+        api_key = api_key_of(response.request)
+        if code == RATE_LIMIT_EXCEEDED:
+            if api_key:
+                self.api_keys.rate_limited(api_key)
+            raise RetriableAPIError(
+                f"Rate limit exceeded for path: {self.path}", response
+            )
+        if code in (INVALID_API_KEY, SUSPENDED_API_KEY) and api_key:
+            # retry with another key, unless there are none left to use
+            if self.api_keys.rejected(api_key):
+                raise RetriableAPIError(
+                    f"API key rejected with error {code} for path: {self.path}",
+                    response,
+                )
+        if code in TRANSIENT_ERRORS:
+            raise RetriableAPIError(
+                f"Last.fm error {code} for path: {self.path}", response
+            )
+        if code is not None and response.status_code < 500:
+            raise LastFMAPIError(code, self.decode_response(response).get("message"))
+        super().validate_response(response)
+
     # TODO: temporary workaround
     # remove this after https://github.com/meltano/sdk/issues/1236
     # is merged and SDK version bumped
@@ -0,0 +1,113 @@
+"""Helpers for fetching from the API on background threads."""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+    executor: Executor, fn: Callable[[T], R], items: Iterable[T], limit: int
+) -> Iterator[R]:
+    """Like `executor.map`, but with at most `limit` calls submitted at a time.
+
+    Results are yielded in the order of `items`.
+    """
+    pending: Deque["Future[R]"] = deque()
+    try:
+        for item in items:
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class _Done:
+    pass
+
+
+class _Failed:
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+class _Closed(Exception):
+    pass
+
+
+class Prefetcher:
+    """Drains iterables on a bounded pool of worker threads.
+
+    Each submitted iterable is consumed on a worker into its own bounded queue,
+    and the returned iterator replays the items on the calling thread in their
+    original order. This lets slow producers (HTTP requests) overlap while all
+    of the side effects of consuming them (writing messages, updating state)
+    stay on a single thread.
+    """
+
+    def __init__(self, max_workers: int, buffer_size: int = 1000) -> None:
+        """Create a pool draining up to `max_workers` iterables at the same time.
+
+        Each worker buffers up to `buffer_size` items before it waits for the
+        consumer to catch up.
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tap-lastfm"
+        )
+        self._buffer_size = buffer_size
+        self._closed = threading.Event()
+
+    def submit(self, producer: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """Start draining `producer()` and return an iterator over its items.
+
+        Exceptions raised by the producer are re-raised by the iterator.
+        """
+        items: "queue.Queue[Any]" = queue.Queue(maxsize=self._buffer_size)
+        self._executor.submit(self._drain, producer, items)
+        return self._replay(items)
+
+    def close(self) -> None:
+        """Stop all workers, abandoning any items not yet consumed."""
+        self._closed.set()
+        self._executor.shutdown(wait=False)
+
+    def _put(self, items: "queue.Queue[Any]", item: Any) -> None:
+        while not self._closed.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Closed()
+
+    def _drain(self, producer: Callable[[], Iterable[Any]], items: "queue.Queue[Any]"):
+        if self._closed.is_set():
+            return
+        try:
+            for item in producer():
+                self._put(items, item)
+            self._put(items, _Done())
+        except _Closed:
+            pass
+        except BaseException as e:
+            try:
+                self._put(items, _Failed(e))
+            except _Closed:
+                pass
+
+    def _replay(self, items: "queue.Queue[Any]") -> Iterator[Any]:
+        while True:
+            item = items.get()
+            if isinstance(item, _Done):
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
@@ -0,0 +1,191 @@
+"""Timing of where a sync spends its time, per stream and partition."""
+
+import contextlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, ContextManager, DefaultDict, List, Optional, Tuple
+
+# Stages timed, in the order a record passes through them
+RATE_LIMIT = "rate_limit"
+NETWORK = "network"
+BACKOFF = "backoff"
+DECODE = "decode"
+MAPPING = "mapping"
+EMIT = "emit"
+STAGES = [RATE_LIMIT, NETWORK, BACKOFF, DECODE, MAPPING, EMIT]
+
+# Counters
+RETRIES = "retries"
+BYTES_RECEIVED = "bytes_received"
+RECORDS = "records"
+DUPLICATES = "duplicates"
+
+# A stream name and username partition, which may be None
+Key = Tuple[str, Optional[str]]
+
+_NOT_TIMED: ContextManager[None] = contextlib.nullcontext()
+
+
+class _Timer:
+    """Times a stage, excluding any stages timed within it on the same thread."""
+
+    def __init__(self, metrics: "Metrics", stage: str, key: Key) -> None:
+        self.metrics = metrics
+        self.stage = stage
+        self.key = key
+        self.nested = 0.0
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.metrics._stack().append(self)
+        self.started = self.metrics._clock()
+
+    def __exit__(self, *exc) -> None:
+        elapsed = self.metrics._clock() - self.started
+        stack = self.metrics._stack()
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.metrics.add_time(self.stage, elapsed - self.nested, self.key)
+
+
+class Metrics:
+    """Accumulates time spent per stage and counters, and logs them.
+
+    Timings and counters are logged as Singer metric lines every
+    `log_interval` seconds, covering the interval just passed, and summarised
+    by `log_summary` at the end of a run. When disabled, every method returns
+    immediately.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        logger: Optional[logging.Logger] = None,
+        log_interval: float = 60,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        """Create a collector of metrics, which collects nothing unless `enabled`.
+
+        The metrics are logged to `logger` every `log_interval` seconds, timed
+        with `clock`.
+        """
+        self.enabled = enabled
+        self._logger = logger
+        self._log_interval = log_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._times: DefaultDict[Tuple[Key, str], float] = defaultdict(float)
+        self._counts: DefaultDict[Tuple[Key, str], int] = defaultdict(int)
+        self._interval_times: DefaultDict[Tuple[Key, str], float] = defaultdict(float)
+        self._interval_counts: DefaultDict[Tuple[Key, str], int] = defaultdict(int)
+        self._started = clock()
+        self._interval_started = self._started
+
+    def timer(
+        self, stage: str, stream: str, partition: Optional[str] = None
+    ) -> ContextManager[None]:
+        """Return a context manager which times a stage.
+
+        Time spent in other stages timed within it, on the same thread, is not
+        counted towards it. If no partition is given, that of the stage it is
+        timed within is used.
+        """
+        if not self.enabled:
+            return _NOT_TIMED
+        if partition is None:
+            stack = self._stack()
+            if stack and stack[-1].key[0] == stream:
+                partition = stack[-1].key[1]
+        return _Timer(self, stage, (stream, partition))
+
+    def add_time(self, stage: str, seconds: float, key: Key) -> None:
+        """Count time spent in a stage."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._times[key, stage] += seconds
+            self._interval_times[key, stage] += seconds
+            self._maybe_log()
+
+    def count(self, counter: str, value: int, key: Key) -> None:
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counts[key, counter] += value
+            self._interval_counts[key, counter] += value
+            self._maybe_log()
+
+    def log_summary(self) -> None:
+        """Log the totals over the whole run, per stream and partition."""
+        if not self.enabled or not self._logger:
+            return
+        with self._lock:
+            self._log_interval_metrics()
+            elapsed = self._clock() - self._started
+            keys = sorted(
+                {key for key, _ in [*self._times, *self._counts]},
+                key=lambda k: (k[0], k[1] or ""),
+            )
+            for key in keys:
+                stream, partition = key
+                name = f"{stream}[{partition}]" if partition else stream
+                times = ", ".join(
+                    f"{stage} {self._times[key, stage]:.2f}s"
+                    for stage in STAGES
+                    if (key, stage) in self._times
+                )
+                self._logger.info(
+                    f"Time spent on {name}: {times}; "
+                    f"{self._counts[key, RECORDS]} records, "
+                    f"{self._counts[key, DUPLICATES]} duplicates skipped, "
+                    f"{self._counts[key, RETRIES]} retries, "
+                    f"{self._counts[key, BYTES_RECEIVED] / 2**20:.1f} MiB received"
+                )
+            self._logger.info(f"Sync took {elapsed:.2f}s in total")
+
+    def _stack(self) -> List[_Timer]:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _maybe_log(self) -> None:
+        if self._clock() - self._interval_started >= self._log_interval:
+            self._log_interval_metrics()
+
+    def _log_interval_metrics(self) -> None:
+        if self._logger:
+            for ((stream, partition), stage), seconds in self._interval_times.items():
+                self._log_point(
+                    "timer", "stage_duration", seconds, stream, partition, stage
+                )
+            for ((stream, partition), counter), value in self._interval_counts.items():
+                self._log_point("counter", counter, value, stream, partition)
+        self._interval_times.clear()
+        self._interval_counts.clear()
+        self._interval_started = self._clock()
+
+    def _log_point(
+        self,
+        metric_type: str,
+        metric: str,
+        value: float,
+        stream: str,
+        partition: Optional[str],
+        stage: Optional[str] = None,
+    ) -> None:
+        tags = {"stream": stream}
+        if partition:
+            tags["username"] = partition
+        if stage:
+            tags["stage"] = stage
+        point = {"type": metric_type, "metric": metric, "value": value, "tags": tags}
+        assert self._logger is not None
+        self._logger.info(f"METRIC: {json.dumps(point)}")
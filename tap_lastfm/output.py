@@ -0,0 +1,144 @@
+"""Writing Singer messages to stdout in large chunks, for high throughput."""
+
+import datetime
+import json
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, cast
+
+import singer
+from singer import StateMessage
+from singer_sdk import Stream
+from singer_sdk.mapper import SameRecordTransform
+
+if TYPE_CHECKING:
+    from tap_lastfm.tap import TapLastFM
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Buffered output is written out once it reaches this size
+BUFFER_BYTES = 2**20
+
+_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+
+def dumps(value: Any) -> bytes:
+    """Serialise a value as compact UTF-8 JSON, with orjson if installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return _encoder.encode(value).encode()
+
+
+class MessageWriter:
+    """Buffers Singer messages, to write them out in large chunks.
+
+    The buffer is written out whenever it is full and by `flush`, which should
+    be called after each STATE message so that the target can commit it.
+    Records may be written without their message being built by the SDK, in
+    which case the JSON before and after each record is built once per stream.
+    """
+
+    def __init__(
+        self,
+        buffer_bytes: int = BUFFER_BYTES,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Create a writer which buffers up to `buffer_bytes` of messages."""
+        self.buffer_bytes = buffer_bytes
+        self._clock = clock
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._prefixes: Dict[str, bytes] = {}
+        # the time extracted, to the second, and the end of a record message
+        self._suffix: Tuple[int, bytes] = (-1, b"")
+
+    def write_record(self, stream: str, record: dict) -> None:
+        """Buffer a RECORD message, extracted now."""
+        prefix = self._prefixes.get(stream)
+        if prefix is None:
+            prefix = b'{"type":"RECORD","stream":' + dumps(stream) + b',"record":'
+            self._prefixes[stream] = prefix
+        now = int(self._clock())
+        if now != self._suffix[0]:
+            extracted = singer.utils.strftime(
+                datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+            )
+            self._suffix = (now, b',"time_extracted":' + dumps(extracted) + b"}\n")
+        self._append(prefix + dumps(record) + self._suffix[1])
+
+    def write_message(self, message: singer.Message) -> None:
+        """Buffer any Singer message."""
+        self._append(dumps(message.asdict()) + b"\n")
+
+    def flush(self) -> None:
+        """Write out everything buffered."""
+        if not self._chunks:
+            return
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        out = sys.stdout
+        buffer = getattr(out, "buffer", None)
+        if buffer is None:
+            out.write(data.decode())
+        else:
+            out.flush()
+            buffer.write(data)
+        out.flush()
+
+    def _append(self, data: bytes) -> None:
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_bytes:
+            self.flush()
+
+
+class BufferedOutputStream(Stream):
+    """A stream which writes its messages with the tap's `MessageWriter`.
+
+    If the tap has no writer, the SDK writes each message itself. Records are
+    written as they are, skipping the SDK's checks against the schema, unless
+    the stream is mapped or any of its properties are deselected. Records must
+    already match the schema, as those built from `Property` declarations do.
+    """
+
+    _writes_records_as_is: Optional[bool] = None
+
+    @property
+    def output_writer(self) -> Optional[MessageWriter]:
+        """Return the writer shared by all streams, if there is one."""
+        return cast("TapLastFM", self._tap).output_writer
+
+    def _write_state_message(self) -> None:
+        writer = self.output_writer
+        if writer is None:
+            return super()._write_state_message()
+        writer.write_message(StateMessage(value=self.tap_state))
+        writer.flush()
+
+    def _write_schema_message(self) -> None:
+        writer = self.output_writer
+        if writer is None:
+            return super()._write_schema_message()
+        for message in self._generate_schema_messages():
+            writer.write_message(message)
+
+    def _write_record_message(self, record: dict) -> None:
+        writer = self.output_writer
+        if writer is None:
+            return super()._write_record_message(record)
+        if self._writes_records_as_is is None:
+            self._writes_records_as_is = (
+                len(self.stream_maps) == 1
+                and isinstance(self.stream_maps[0], SameRecordTransform)
+                and self.stream_maps[0].stream_alias == self.name
+                and all(self.mask.values())
+            )
+        if self._writes_records_as_is:
+            writer.write_record(self.name, record)
+            return
+        for message in self._generate_record_messages(record):
+            writer.write_message(message)
@@ -1,12 +1,123 @@
 """Base Stream type which declares more powerful properties."""
 
-from typing import Any, Callable, Generic, List, Optional, Tuple, Type, Union, cast
+import copy
+import functools
+import re
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 from xmlrpc.client import Boolean
 
-from jsonpath_ng.ext import parse as jsonpath_parse
 from singer_sdk import typing as th  # JSON Schema typing helpers
 from singer_sdk.streams.rest import RESTStream
 
+Extractor = Callable[[dict], Any]
+
+# A selector segment is either ("field", name) or ("filter", key, value)
+Segment = Tuple[str, ...]
+
+_MISSING = object()
+
+_SEGMENT_RE = re.compile(
+    r"\.(?P<field>[A-Za-z_][A-Za-z0-9_]*)"
+    r'|\["(?P<quoted>[^"\\]*)"\]'
+    r'|\[\?(?P<key>[A-Za-z_][A-Za-z0-9_]*)="(?P<value>[^"\\]*)"\]'
+)
+
+
+def timestamp_to_rfc3339(value: Union[str, int]) -> str:
+    """Cast a Unix timestamp to an RFC 3339 date-time string in UTC.
+
+    This gives the string the SDK would write for
+    `pendulum.from_timestamp(value)`, without building the datetime.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(int(value)))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_jsonpath(selector: str) -> Any:
+    """Parse a jsonpath selector, once per process for each distinct selector."""
+    # parsing is slow, and most selectors never need it, see `Property.compile`
+    from jsonpath_ng.ext import parse as jsonpath_parse
+
+    return jsonpath_parse(selector)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_simple_selector(selector: str) -> Optional[Tuple[Segment, ...]]:
+    """Split a jsonpath selector into plain field and equality filter segments.
+
+    Only the subset of jsonpath used by the stream declarations is understood:
+    `.name`, `["name"]` and `[?key="value"]`. Anything else returns `None` so
+    the caller can fall back to a full jsonpath evaluation. Results are cached,
+    as the same selectors are declared by several streams.
+    """
+    if not selector.startswith("$"):
+        return None
+    segments: List[Segment] = []
+    pos = 1
+    while pos < len(selector):
+        match = _SEGMENT_RE.match(selector, pos)
+        if not match:
+            return None
+        if match.group("key") is not None:
+            segments.append(("filter", match.group("key"), match.group("value")))
+        elif match.group("field") is not None:
+            segments.append(("field", match.group("field")))
+        else:
+            segments.append(("field", match.group("quoted")))
+        pos = match.end()
+    return tuple(segments)
+
+
+def _resolve_fields(fields: Tuple[str, ...], value: Any) -> Any:
+    # mirrors `jsonpath_ng.Fields`: anything but a dict has no children
+    for field in fields:
+        if not isinstance(value, dict):
+            return _MISSING
+        value = value.get(field, _MISSING)
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _resolve_all(segments: Sequence[Segment], value: Any) -> List[Any]:
+    # mirrors `jsonpath_ng.ext.Filter`: a dict is filtered by its values
+    matches = [value]
+    for segment in segments:
+        if segment[0] == "field":
+            matches = [
+                m[segment[1]]
+                for m in matches
+                if isinstance(m, dict) and segment[1] in m
+            ]
+            continue
+        _, key, expected = segment
+        found: List[Any] = []
+        for m in matches:
+            if not isinstance(m, (dict, list)):
+                continue
+            items = m.values() if isinstance(m, dict) else m
+            found.extend(
+                i
+                for i in items
+                if isinstance(i, dict) and key in i and i[key] == expected
+            )
+        matches = found
+    return matches
+
 
 class Property(th.Property, Generic[th.W]):
     """Wrapper for `th.Property` which adds declarative transformations."""
@@ -37,13 +148,27 @@ class Property(th.Property, Generic[th.W]):
         """
         super().__init__(name, wrapped, **kwargs)
         self.jsonpath_selector = jsonpath_selector or f'$["{name}"]'
-        self._selector = jsonpath_parse(self.jsonpath_selector)
         self.cast = cast
         self.ignore_missing = ignore_missing
 
+    @property
+    def _selector(self) -> Any:
+        return compile_jsonpath(self.jsonpath_selector)
+
+    def _missing(self, e: Optional[Exception] = None) -> Any:
+        if self.ignore_missing:
+            return None
+        raise Exception(
+            f"Unable to find property '{self.name}' ",
+            f"at jsonpath '{self.jsonpath_selector}'.",
+        ) from e
+
     def read_value(self, row: dict) -> Optional[Any]:
         """Read and cast the value from the row.
 
+        This evaluates the full jsonpath selector on every call. Streams use
+        the faster extractor built by `compile` instead.
+
         Args:
             row: the raw data from the source.
 
@@ -68,12 +193,135 @@ class Property(th.Property, Generic[th.W]):
         try:
             return self.cast(value[0].value)
         except IndexError as e:
-            if self.ignore_missing:
-                return None
-            raise Exception(
-                f"Unable to find property '{self.name}' ",
-                f"at jsonpath '{self.jsonpath_selector}'.",
-            ) from e
+            return self._missing(e)
+
+    def compile(self) -> Extractor:
+        """Build a function which behaves like `read_value` for this property.
+
+        Plain field paths become direct dict lookups, and sibling properties
+        which filter the same array (e.g. one per image size) share a single
+        scan of that array. Selectors outside that subset use jsonpath.
+        """
+        if isinstance(self.wrapped, th.ObjectType):
+            return _compile_object(cast(List[Property], self.wrapped.wrapped))
+
+        parsed = parse_simple_selector(self.jsonpath_selector)
+        if parsed is None:
+            # fail now rather than on the first record if the selector is invalid
+            compile_jsonpath(self.jsonpath_selector)
+            return self.read_value
+        segments: Tuple[Segment, ...] = parsed
+
+        _cast = self.cast
+        if isinstance(self.wrapped, th.ArrayType):
+            return lambda row: [_cast(v) for v in _resolve_all(segments, row)]
+
+        if all(s[0] == "field" for s in segments):
+            fields = tuple(s[1] for s in segments)
+
+            def extract_field(row: dict) -> Any:
+                value = _resolve_fields(fields, row)
+                if value is _MISSING:
+                    return self._missing()
+                return _cast(value)
+
+            return extract_field
+
+        def extract_filtered(row: dict) -> Any:
+            found = _resolve_all(segments, row)
+            if not found:
+                return self._missing()
+            return _cast(found[0])
+
+        return extract_filtered
+
+
+def _bucket_key(prop: Property) -> Optional[Tuple[Tuple[Any, ...], str]]:
+    # properties differing only by the value of a single filter can share a scan;
+    # returns the shared (prefix, filter key, suffix) and this property's value
+    if isinstance(prop.wrapped, (th.ObjectType, th.ArrayType)):
+        return None
+    segments = parse_simple_selector(prop.jsonpath_selector)
+    if segments is None:
+        return None
+    filters = [i for i, s in enumerate(segments) if s[0] == "filter"]
+    if len(filters) != 1:
+        return None
+    i = filters[0]
+    prefix = tuple(s[1] for s in segments[:i])
+    (_, filter_key, value), *suffix = segments[i:]
+    return (prefix, filter_key, tuple(s[1] for s in suffix)), value
+
+
+def _scan(key: Tuple[Any, ...], row: dict) -> Dict[Any, Any]:
+    # index the filtered array by the filter value, keeping the first match
+    # which resolves, as `jsonpath_ng` would return it first
+    prefix, filter_key, suffix = key
+    index: Dict[Any, Any] = {}
+    container = _resolve_fields(prefix, row)
+    if not isinstance(container, (dict, list)):
+        return index
+    items = container.values() if isinstance(container, dict) else container
+    for item in items:
+        if not isinstance(item, dict) or filter_key not in item:
+            continue
+        bucket = item[filter_key]
+        if not isinstance(bucket, str) or bucket in index:
+            continue
+        value = _resolve_fields(suffix, item)
+        if value is not _MISSING:
+            index[bucket] = value
+    return index
+
+
+def _plan_object(props: List[Property]) -> Tuple[List[Any], List[Tuple[str, Any]]]:
+    # returns the array scans to run per row, and for each property either its
+    # own extractor or a (scan number, filter value, property) lookup
+    keys = [_bucket_key(p) for p in props]
+    counts: Dict[Any, int] = {}
+    for k in keys:
+        if k is not None:
+            counts[k[0]] = counts.get(k[0], 0) + 1
+    scans = [scan for scan, count in counts.items() if count > 1]
+
+    entries: List[Tuple[str, Any]] = []
+    for p, k in zip(props, keys):
+        if k is not None and k[0] in scans:
+            entries.append((p.name, (scans.index(k[0]), k[1], p)))
+        else:
+            entries.append((p.name, p.compile()))
+    return scans, entries
+
+
+def _compile_object(props: List[Property]) -> Extractor:
+    scans, entries = _plan_object(props)
+
+    if not scans:
+
+        def extract_plain(row: dict) -> dict:
+            return {name: fn(row) for name, fn in entries}
+
+        return extract_plain
+
+    def read(row: dict, entry: Any, indexes: List[Dict[Any, Any]]) -> Any:
+        if callable(entry):
+            return entry(row)
+        scan, expected, p = entry
+        value = indexes[scan].get(expected, _MISSING)
+        if value is _MISSING:
+            return p._missing()
+        return p.cast(value)
+
+    def extract(row: dict) -> dict:
+        indexes = [_scan(key, row) for key in scans]
+        return {name: read(row, entry, indexes) for name, entry in entries}
+
+    return extract
+
+
+def compile_properties(props: Iterable[Property]) -> Callable[[dict], dict]:
+    """Build a single record mapper for a list of properties."""
+    return _compile_object(list(props))
 
 
 class PropertyStream(RESTStream):
@@ -85,6 +333,24 @@ class PropertyStream(RESTStream):
 
     properties: th.PropertiesList
     records_jsonpath: str = "$[*]"
+    _extract_record: Callable[[dict], dict]
+    _properties_schema: dict
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        """Compile the record mapper and schema once, when the class is built."""
+        super().__init_subclass__(**kwargs)
+        if "properties" in cls.__dict__:
+            props = cast(List[Tuple[str, Property]], cls.properties.items())
+            mapper = compile_properties(p for _, p in props)
+            cls._extract_record = staticmethod(mapper)  # type: ignore
+            cls._properties_schema = cls.properties.to_dict()
+
+    def build_schema(self) -> dict:
+        """Return a copy of the schema of `properties`, to adjust as needed.
+
+        This is called once per stream, and the result kept as its schema.
+        """
+        return copy.deepcopy(self._properties_schema)
 
     @property
     def schema(self) -> dict:
@@ -95,9 +361,12 @@ class PropertyStream(RESTStream):
             JSON Schema dictionary for this stream.
 
         """
-        return self.properties.to_dict()
+        try:
+            return self._schema
+        except AttributeError:
+            self._schema = self.build_schema()
+            return self._schema
 
     def post_process(self, row: dict, context: Optional[dict] = None) -> Optional[dict]:
         """Remap and cast properties by jsonpath."""
-        props = cast(List[Tuple[str, Property]], self.properties.items())
-        return {k: p.read_value(row) for k, p in props}
+        return self._extract_record(row)
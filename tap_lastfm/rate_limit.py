@@ -0,0 +1,124 @@
+"""Client-side rate limiting for requests to the Last.fm API."""
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+class RateLimiter:
+    """A thread-safe token bucket which adapts to throttling by the API.
+
+    Each request takes one token. Tokens refill at `rate` per second, up to
+    `burst`. When the API reports the rate limit was exceeded, the rate is
+    halved, then it recovers gradually towards the configured maximum with
+    each successful request.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        burst: int = 1,
+        logger: Optional[logging.Logger] = None,
+        log_interval: float = 60,
+        name: str = "",
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Create a limiter allowing `max_rate` requests per second.
+
+        `burst` requests may be sent back to back. The achieved rate is
+        reported to `logger`, if given, every `log_interval` seconds, prefixed
+        with `name`. `clock` and `sleep` stand in for monotonic time and waiting.
+        """
+        self.max_rate = max_rate
+        self.min_rate = max_rate / 16
+        self.rate = max_rate
+        self.burst = max(1, burst)
+        self.throttle_count = 0
+        self.name = name
+        self._logger = logger
+        self._log_interval = log_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._started = self._updated
+        self._request_count = 0
+        self._interval_started = self._updated
+        self._interval_count = 0
+
+    def acquire(self) -> float:
+        """Wait until a request may be sent. Returns the time waited."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._request_count += 1
+            self._interval_count += 1
+            self._log_rate(now)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def wait_time(self) -> float:
+        """Return how long a request would have to wait if sent now."""
+        with self._lock:
+            tokens = min(
+                self.burst,
+                self._tokens + (self._clock() - self._updated) * self.rate,
+            )
+        return max(0.0, (1 - tokens) / self.rate)
+
+    def succeeded(self) -> None:
+        """Recover some of the request rate after a successful request."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def throttled(self) -> None:
+        """Slow down after the API reported the rate limit was exceeded."""
+        with self._lock:
+            self.throttle_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+        if self._logger:
+            self._logger.warning(
+                f"{self._name_prefix}Rate limit exceeded, "
+                f"slowing to {self.rate:.2f} requests/s"
+            )
+
+    def achieved_rate(self) -> float:
+        """Return the average number of requests per second since creation."""
+        elapsed = self._clock() - self._started
+        return self._request_count / elapsed if elapsed > 0 else 0.0
+
+    def log_summary(self) -> None:
+        """Report the request rate over the whole run."""
+        if self._logger:
+            self._logger.info(
+                f"{self._name_prefix}Made {self._request_count} requests at "
+                f"{self.achieved_rate():.2f} requests/s "
+                f"(limit {self.max_rate:.2f}/s, throttled {self.throttle_count} times)"
+            )
+
+    @property
+    def _name_prefix(self) -> str:
+        return f"{self.name}: " if self.name else ""
+
+    def _log_rate(self, now: float) -> None:
+        elapsed = now - self._interval_started
+        if not self._logger or elapsed < self._log_interval:
+            return
+        self._logger.info(
+            f"{self._name_prefix}Made {self._interval_count} requests "
+            f"in the last {elapsed:.0f}s "
+            f"({self._interval_count / elapsed:.2f} requests/s, "
+            f"currently limited to {self.rate:.2f}/s)"
+        )
+        self._interval_started = now
+        self._interval_count = 0
@@ -0,0 +1,100 @@
+"""Splitting users between several tap processes, and merging their state.
+
+Each user belongs to exactly one of `shard_count` shards, chosen by a hash of
+their username, so that the split is stable across runs and machines. A shard
+only keeps the state partitions of its own users, which lets the states of
+every shard be merged back into one with `merge_states`.
+"""
+
+import argparse
+import json
+import sys
+import zlib
+from typing import Any, Dict, Iterable, List
+
+
+def shard_of(username: str, shard_count: int) -> int:
+    """Return the index of the shard a user belongs to."""
+    # Last.fm usernames are case insensitive
+    return zlib.crc32(username.lower().encode()) % shard_count
+
+
+def validate_shard(shard_index: int, shard_count: int) -> None:
+    """Raise `ValueError` unless the shard index is within the shard count."""
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(
+            f"Invalid shard {shard_index} of {shard_count}, expected a shard_count "
+            "of at least 1 and a shard_index from 0 to shard_count - 1"
+        )
+
+
+def select_shard(
+    usernames: Iterable[str], shard_index: int, shard_count: int
+) -> List[str]:
+    """Return the usernames which belong to a shard, in their original order."""
+    validate_shard(shard_index, shard_count)
+    return [u for u in usernames if shard_of(u, shard_count) == shard_index]
+
+
+def filter_state(state: dict, shard_index: int, shard_count: int) -> None:
+    """Drop the state partitions of users in other shards, in place.
+
+    Partitions without a username in their context are kept.
+    """
+    validate_shard(shard_index, shard_count)
+    for stream_state in state.get("bookmarks", {}).values():
+        if "partitions" not in stream_state:
+            continue
+        stream_state["partitions"] = [
+            p
+            for p in stream_state["partitions"]
+            if "username" not in p.get("context", {})
+            or shard_of(p["context"]["username"], shard_count) == shard_index
+        ]
+
+
+def merge_states(states: Iterable[dict]) -> dict:
+    """Merge the states of several shards into one.
+
+    The partitions of each stream are combined. Where states disagree on
+    anything else, or on the same partition, the later state wins.
+    """
+    merged: Dict[str, Any] = {}
+    bookmarks: Dict[str, dict] = {}
+    # the partitions of each stream, by their context
+    partitions: Dict[str, Dict[str, dict]] = {}
+    for state in states:
+        merged.update({k: v for k, v in state.items() if k != "bookmarks"})
+        for stream_name, stream_state in state.get("bookmarks", {}).items():
+            bookmarks.setdefault(stream_name, {}).update(
+                {k: v for k, v in stream_state.items() if k != "partitions"}
+            )
+            if "partitions" not in stream_state:
+                continue
+            stream_partitions = partitions.setdefault(stream_name, {})
+            for partition in stream_state["partitions"]:
+                key = json.dumps(partition.get("context"), sort_keys=True)
+                stream_partitions[key] = partition
+    for stream_name, stream_partitions in partitions.items():
+        bookmarks[stream_name]["partitions"] = list(stream_partitions.values())
+    if bookmarks:
+        merged["bookmarks"] = bookmarks
+    return merged
+
+
+def main() -> None:
+    """Merge the state files of every shard, and print the merged state."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("states", nargs="+", help="state files, one per shard")
+    args = parser.parse_args()
+
+    states = []
+    for path in args.states:
+        with open(path) as f:
+            states.append(json.load(f))
+    json.dump(merge_states(states), sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
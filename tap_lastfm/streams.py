@@ -1,18 +1,122 @@
 """Stream type classes for tap-lastfm."""
 
-from typing import Any, Dict, Iterator, List, Optional
-from urllib import parse
+import itertools
+import json
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Any,
+    Deque,
+    Dict,
+    Generator,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
 
 import pendulum
 import requests
 from pendulum.datetime import DateTime
 from singer_sdk import typing as th  # JSON Schema typing helpers
+from singer_sdk.helpers._state import (
+    PROGRESS_MARKERS,
+    finalize_state_progress_markers,
+    increment_state,
+)
 
-from tap_lastfm.client import LastFMStream
-from tap_lastfm.property_stream import Property
+from tap_lastfm.client import USER_NOT_FOUND, LastFMAPIError, LastFMStream
+from tap_lastfm.concurrency import Prefetcher, ordered_map
+from tap_lastfm.metrics import DUPLICATES
+from tap_lastfm.output import BufferedOutputStream
+from tap_lastfm.property_stream import Property, timestamp_to_rfc3339
+
+if TYPE_CHECKING:
+    from tap_lastfm.tap import TapLastFM
 
 IMAGE_SIZES = ["small", "medium", "large", "extralarge"]
 
+# Bounds on the time windows scrobbles are requested in
+MIN_WINDOW_SECONDS = 60 * 60
+MAX_WINDOW_SECONDS = 10 * 365 * 24 * 60 * 60
+MAX_WINDOW_GROWTH = 4
+
+# Last.fm accepts scrobbles up to two weeks old, so windows which ended before
+# then are complete and their pages can be cached
+CLOSED_WINDOW_AGE = pendulum.duration(days=14)
+
+# Artist fields left out of slim scrobbles, which are in the artists stream
+SLIM_ARTIST_FIELDS = ["url", "image"]
+
+# The time of the newest scrobbles written, and their names, or `None` if every
+# scrobble at that time was written
+Written = Tuple[int, Optional[Set[str]]]
+
+# Yielded by `request_records` of a child stream once everything before it
+# can be committed to the partition's bookmark, which is then written out
+CHECKPOINT = cast(dict, object())
+
+
+def add_written(written: Optional[Written], uts: int, name: str) -> Written:
+    """Return `written` with a scrobble added, if it is at least as new."""
+    if written is None or uts > written[0]:
+        return uts, {name}
+    if uts == written[0] and written[1] is not None:
+        written[1].add(name)
+    return written
+
+
+def merge_written(
+    written: Optional[Written], newer: Optional[Written]
+) -> Optional[Written]:
+    """Return the newest scrobbles written of either, combined if at once."""
+    if written is None or (newer is not None and newer[0] > written[0]):
+        return newer
+    if newer is None or newer[0] < written[0]:
+        return written
+    if written[1] is None or newer[1] is None:
+        return written[0], None
+    return written[0], written[1] | newer[1]
+
+
+def written_in_state(state: dict) -> Optional[Written]:
+    """Return the newest records written, as kept in a partition's state.
+
+    The names kept are only used if they are at the bookmark, which may have
+    been moved back to write records again. Otherwise every record at the
+    bookmark counts as written.
+    """
+    if not state.get("replication_key_value"):
+        return None
+    bookmark = cast(DateTime, pendulum.parse(state["replication_key_value"]))
+    uts = int(bookmark.timestamp())
+    written = state.get("written", {})
+    if written.get("uts") == uts and "names" in written:
+        return uts, set(written["names"])
+    return uts, None
+
+
+class StateUpdate(dict):
+    """Values to keep in the partition's state once everything before is written.
+
+    Yielded by `request_records` of a child stream.
+    """
+
+
+class ResumePoint(dict):
+    """Where to carry on from if a sync is interrupted after this point.
+
+    Yielded by `request_records` of a child stream, and kept in the partition's
+    state as `resume` until the next CHECKPOINT. Its `latest` value is the
+    greatest replication key value yielded since the last CHECKPOINT.
+    """
+
 
 def blank_to_null(v: Any) -> Any:  # noqa: D103
     return v or None
@@ -26,13 +130,24 @@ def int_to_bool(v: str) -> bool:  # noqa: D103
     return bool(int(v))
 
 
-def get_query_params(request: requests.PreparedRequest) -> dict:
-    """Parse a param dictionary from a request object."""
-    return {
-        k: v[0]
-        for k, v in parse.parse_qs(str(parse.urlparse(request.url).query)).items()
-    }
+def image_property(path: str) -> Property:
+    """Declare an `image` object of the URLs at `path`, one for each size."""
+    return Property(
+        "image",
+        th.ObjectType(
+            *[
+                Property(
+                    size,
+                    th.StringType,
+                    jsonpath_selector=f'{path}[?size="{size}"]["#text"]',
+                )
+                for size in IMAGE_SIZES
+            ]
+        ),
+    )
+
 
+IMAGE_PROPERTY = image_property("$.image")
 
 USER_PROPERTIES: List[Property] = [
     Property("realname", th.StringType),
@@ -59,21 +174,9 @@ USER_PROPERTIES: List[Property] = [
         "registered_at",
         th.DateTimeType,
         jsonpath_selector='$.registered["unixtime"]',
-        cast=lambda v: pendulum.from_timestamp(int(v)),
-    ),
-    Property(
-        "image",
-        th.ObjectType(
-            *[
-                Property(
-                    size,
-                    th.StringType,
-                    jsonpath_selector=f'$.image[?size="{size}"]["#text"]',
-                )
-                for size in IMAGE_SIZES
-            ]
-        ),
+        cast=timestamp_to_rfc3339,
     ),
+    IMAGE_PROPERTY,
 ]
 
 
@@ -95,37 +198,89 @@ class UsersStream(LastFMStream):
     def __init__(self, *args, **kwargs):
         """Construct a UsersStream."""
         super().__init__(*args, **kwargs)
-        self._usernames_iterator: Iterator[str] = iter(self.config["usernames"])
-
-    def get_next_username(self) -> Optional[str]:
-        """Return the next username from the list of usernames in the config."""
-        return next(self._usernames_iterator, None)
-
-    def get_next_page_token(
-        self, response: requests.Response, previous_token: Optional[Any]
-    ) -> Optional[Any]:
-        """Return a token for identifying next page or None if no more pages."""
-        return self.get_next_username()
+        self._prefetcher: Optional[Prefetcher] = None
+        self._pending_children: Deque[dict] = deque()
 
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[Any]
     ) -> Dict[str, Any]:
         """Return a dictionary of values to be used in URL parameterization."""
         return {
-            **super().get_url_params(context, next_page_token),
-            "user": next_page_token or self.get_next_username(),
+            **super().get_url_params(context, None),
+            "user": next_page_token,
         }
 
+    def request_user(self, context: Optional[dict], username: str) -> List[dict]:
+        """Request a user's info, or return nothing if there is no such user."""
+        try:
+            response = self.request_page(context, username)
+        except LastFMAPIError as e:
+            if e.code != USER_NOT_FOUND:
+                raise
+            self.logger.warning(f"Skipping user [{username}], they do not exist")
+            return []
+        return list(self.parse_response(response))
+
+    def request_records(self, context: Optional[dict]) -> Iterable[dict]:
+        """Request the info of every configured user, several at a time.
+
+        Users are returned in the order they are configured. Only the users in
+        this tap's shard are requested, if the usernames are sharded.
+        """
+        width = self.config.get("max_concurrent_user_info", 4)
+        with ThreadPoolExecutor(
+            max_workers=width, thread_name_prefix="tap-lastfm-users"
+        ) as executor:
+            for records in ordered_map(
+                executor,
+                lambda username: self.request_user(context, username),
+                cast("TapLastFM", self._tap).usernames,
+                limit=width,
+            ):
+                yield from records
+
     def get_child_context(self, record: dict, context: Optional[dict]) -> dict:
         """Create a context for child streams to use.
 
-        Contains both the username of the user and the date they registered.
+        Contains the username of the user, the date they registered and their
+        current playcount.
         """
         return {
             "username": record["username"],
             "registered_at": record["registered_at"],
+            "playcount": record["playcount"],
         }
 
+    def _sync_records(self, context: Optional[dict] = None) -> None:
+        max_concurrent_users = self.config.get("max_concurrent_users", 1)
+        if max_concurrent_users <= 1:
+            return super()._sync_records(context)
+
+        self._prefetcher = Prefetcher(max_workers=max_concurrent_users)
+        try:
+            super()._sync_records(context)
+            while self._pending_children:
+                super()._sync_children(self._pending_children.popleft())
+        finally:
+            self._prefetcher.close()
+            self._prefetcher = None
+            self._pending_children.clear()
+
+    def _sync_children(self, child_context: dict) -> None:
+        # When syncing users concurrently, requests for the next few users are
+        # started in the background while the oldest user's records are written.
+        if self._prefetcher is None:
+            return super()._sync_children(child_context)
+
+        for child_stream in self.child_streams:
+            if child_stream.selected or child_stream.has_selected_descendents:
+                cast(UserChildStream, child_stream).prefetch(
+                    child_context, self._prefetcher
+                )
+        self._pending_children.append(child_context)
+        while len(self._pending_children) > self.config["max_concurrent_users"]:
+            super()._sync_children(self._pending_children.popleft())
+
 
 class UserChildStream(LastFMStream):
     """Base stream which is a child stream of users."""
@@ -134,6 +289,132 @@ class UserChildStream(LastFMStream):
     ignore_parent_replication_key = True
     state_partitioning_keys = ["username"]
 
+    def __init__(self, *args, **kwargs):
+        """Construct a UserChildStream."""
+        super().__init__(*args, **kwargs)
+        self._prefetched: Dict[str, Iterator[dict]] = {}
+
+    # Whether there can only be new records when the user's playcount changes
+    changes_with_playcount = False
+    # Whether records are requested from a time which may have been written
+    # already, so the records at the newest time written are remembered
+    skips_written = False
+
+    def is_unchanged(self, context: dict) -> bool:
+        """Return whether the user's playcount is the same as when last synced."""
+        if not self.changes_with_playcount or not self.config.get(
+            "skip_unchanged_users", True
+        ):
+            return False
+        playcount = self.get_context_state(context).get("playcount")
+        return playcount is not None and playcount == context.get("playcount")
+
+    def prefetch(self, context: dict, prefetcher: Prefetcher) -> None:
+        """Start requesting records for a user before the partition is synced."""
+        if self.is_unchanged(context):
+            return
+        # Requests are built from the partition's bookmark, so make sure it is
+        # in place before another thread reads it
+        self._write_starting_replication_value(context)
+        self._prefetched[context["username"]] = prefetcher.submit(
+            lambda: self.request_records(context)
+        )
+
+    def get_records(self, context: Optional[dict]) -> Iterable[Dict[str, Any]]:
+        """Return a generator of row-type dictionary objects."""
+        assert context is not None
+        if self.is_unchanged(context):
+            self.logger.info(
+                f"Skipping [{context['username']}], "
+                "their playcount has not changed since the last sync"
+            )
+            finalize_state_progress_markers(self.get_context_state(context))
+            return
+        state = self.get_context_state(context)
+        resume = state.get("resume")
+        if resume and self.is_sorted:
+            # the interrupted sync's progress was newest first; the rest of its
+            # window is requested oldest first, then the bookmark moved on to
+            # the newest record it wrote
+            state.pop(PROGRESS_MARKERS, None)
+        elif resume and self.replication_key:
+            # records written before the interruption count towards the bookmark
+            increment_state(
+                state,
+                {self.replication_key: resume["latest"]},
+                self.replication_key,
+                self.is_sorted,
+            )
+        for record in self._records_for(context):
+            if record is CHECKPOINT:
+                finalize_state_progress_markers(state)
+                state.pop("resume", None)
+                self._write_state_message()
+                continue
+            if isinstance(record, StateUpdate):
+                state.update(record)
+                continue
+            if isinstance(record, ResumePoint):
+                state["resume"] = dict(record)
+                self._write_state_message()
+                continue
+            transformed_record = self.post_process(record, context)
+            if transformed_record is None:
+                continue
+            yield transformed_record
+        if self.changes_with_playcount:
+            self.get_context_state(context)["playcount"] = context.get("playcount")
+
+    def _records_for(self, context: dict) -> Iterator[dict]:
+        # the records prefetched for the partition, or else requested now
+        records = self._prefetched.pop(context["username"], None)
+        if records is None:
+            records = iter(self.request_records(context))
+        if self.skips_written:
+            records = self._skip_written(records, context)
+        return records
+
+    def _skip_written(self, records: Iterator[dict], context: dict) -> Iterator[dict]:
+        """Skip records which were written at the newest time written before.
+
+        Windows of time start where the one before ended, and syncs where the
+        last one did, and both ends of a window are inclusive. The names of the
+        records at the newest time written are kept in the partition's state as
+        `written`, updated at each CHECKPOINT, and those records are skipped if
+        they are requested again. Only a single second is kept, so the index
+        stays small.
+        """
+        state = self.get_context_state(context)
+        written = written_in_state(state)
+        newest: Optional[Written] = None
+        if state.get("resume") and not self.is_sorted:
+            # everything from the window's latest record on was written
+            latest = pendulum.parse(state["resume"]["latest"])
+            newest = (int(cast(DateTime, latest).timestamp()), None)
+        skipped = 0
+        for record in records:
+            if record is CHECKPOINT:
+                written = merge_written(written, newest)
+                newest = None
+                if written is not None:
+                    state["written"] = {"uts": written[0]}
+                    if written[1] is not None:
+                        state["written"]["names"] = sorted(written[1])
+            elif record.get("date", {}).get("uts") is not None:
+                uts, name = int(record["date"]["uts"]), record.get("name", "")
+                if written and uts == written[0]:
+                    if written[1] is None or name in written[1]:
+                        skipped += 1
+                        continue
+                newest = add_written(newest, uts, name)
+            yield record
+        if skipped:
+            self.logger.info(
+                f"Skipped {skipped} {self.name} for [{context['username']}] "
+                "which were written already"
+            )
+            self.metrics.count(DUPLICATES, skipped, (self.name, context["username"]))
+
     def post_process(self, row: dict, context: Optional[dict] = None) -> Optional[dict]:
         """As needed, append or transform raw data to match expected structure."""
         # add the username from context as it isn't in the response body
@@ -151,7 +432,10 @@ class ScrobblesStream(UserChildStream):
     replication_key = "date"
     records_jsonpath = "$.recenttracks.track[*]"
     total_pages_jsonpath = '$.recenttracks["@attr"].totalPages'
-    is_sorted = False  # annoyingly only searches in reverse order
+    total_records_jsonpath = '$.recenttracks["@attr"].total'
+    page_size = 200
+    changes_with_playcount = True
+    skips_written = True
     properties = th.PropertiesList(
         Property("name", th.StringType, description="The name of the track"),
         Property(
@@ -168,7 +452,7 @@ class ScrobblesStream(UserChildStream):
             th.DateTimeType,
             description="The time the track was listened to (scrobbled)",
             jsonpath_selector="$.date.uts",
-            cast=lambda x: pendulum.from_timestamp(int(x)),
+            cast=timestamp_to_rfc3339,
         ),
         Property("username", th.StringType),
         Property(
@@ -183,19 +467,7 @@ class ScrobblesStream(UserChildStream):
                     cast=blank_to_null,
                 ),
                 Property("url", th.StringType, jsonpath_selector="$.artist.url"),
-                Property(
-                    "image",
-                    th.ObjectType(
-                        *[
-                            Property(
-                                size,
-                                th.StringType,
-                                jsonpath_selector=f'$.artist.image[?size="{size}"]["#text"]',  # noqa E501
-                            )
-                            for size in IMAGE_SIZES
-                        ]
-                    ),
-                ),
+                image_property("$.artist.image"),
             ),
         ),
         Property(
@@ -211,76 +483,390 @@ class ScrobblesStream(UserChildStream):
                 ),
             ),
         ),
-        Property(
-            "image",
-            th.ObjectType(
-                *[
-                    Property(
-                        size,
-                        th.StringType,
-                        jsonpath_selector=f'$.image[?size="{size}"]["#text"]',
-                    )
-                    for size in IMAGE_SIZES
-                ]
-            ),
-        ),
+        IMAGE_PROPERTY,
     )
 
+    @property
+    def is_sorted(self) -> bool:  # type: ignore[override]
+        """Return whether scrobbles are requested so as to be written oldest first.
+
+        Last.fm only returns scrobbles newest first, so unless `sorted_scrobbles`
+        is set, they are written in that order within each window.
+        """
+        return bool(self.config.get("sorted_scrobbles"))
+
     def _start_time(self, context: dict) -> DateTime:
+        # registered_at is the user record's RFC 3339 string
+        registered_at = cast(DateTime, pendulum.parse(context["registered_at"]))
         start_at = self.get_starting_timestamp(context)
-        if not start_at:
-            start_at = context["registered_at"]
-        if context["registered_at"] > start_at:
-            start_at = context["registered_at"]
-        assert start_at is not None
+        if not start_at or registered_at > start_at:
+            return registered_at
         return pendulum.instance(start_at)
 
-    def _page_token_for(self, start: DateTime, page: int) -> dict:
+    def _page_token_for(
+        self, start: DateTime, page: int, seconds: Optional[int] = None
+    ) -> dict:
+        if seconds:
+            end = start.add(seconds=seconds)
+        else:
+            end = start.add(days=self.config["step_days"])
         return {
             "from": str(int(start.timestamp())),
-            "to": str(int(start.add(days=self.config["step_days"]).timestamp())),
+            "to": str(int(end.timestamp())),
             "page": page,
         }
 
-    def get_next_page_token(
+    def _next_window_seconds(
+        self, page_token: dict, total_records: int, counted: Optional[dict] = None
+    ) -> int:
+        """Size the next window to hold about `target_pages_per_window` pages.
+
+        Scrobble density is estimated from the window just requested, or the
+        part of it `counted` if only that was requested; the change between
+        consecutive windows is limited so a single burst or gap of listening
+        does not swing the window size too far.
+        """
+        previous = int(page_token["to"]) - int(page_token["from"])
+        counted = counted or page_token
+        counted_seconds = int(counted["to"]) - int(counted["from"])
+        target_records = self.config["target_pages_per_window"] * self.page_size
+        if total_records:
+            seconds = int(counted_seconds * target_records / total_records)
+        else:
+            seconds = previous * MAX_WINDOW_GROWTH
+        seconds = max(previous // MAX_WINDOW_GROWTH, seconds)
+        seconds = min(previous * MAX_WINDOW_GROWTH, seconds)
+        return max(MIN_WINDOW_SECONDS, min(MAX_WINDOW_SECONDS, seconds))
+
+    def _next_window(
+        self, page_token: dict, total_records: int, counted: Optional[dict] = None
+    ) -> Optional[dict]:
+        new_start = pendulum.from_timestamp(int(page_token["to"]))
+        if new_start > pendulum.now():
+            return None
+        if not self.config.get("target_pages_per_window"):
+            return self._page_token_for(new_start, page=1)
+        seconds = self._next_window_seconds(page_token, total_records, counted)
+        return self._page_token_for(new_start, page=1, seconds=seconds)
+
+    def _count_scrobbles(self, context: dict, start: int, end: int) -> int:
+        page_token = {"from": str(start), "to": str(end), "page": 1, "limit": "1"}
+        return self.get_total_records(self.request_page(context, page_token))
+
+    def _probe_history(self, context: dict, start: DateTime) -> Optional[DateTime]:
+        """Find where a user's scrobbles begin, to skip years of empty windows.
+
+        Bisects on the number of scrobbles between `start` and a moving end
+        point, requesting a single track each time, until the first scrobble
+        is known to within one `step_days` window. Returns a time at or before
+        the first scrobble after `start`, or `None` if there are none.
+        """
+        lo = int(start.timestamp())
+        hi = int(pendulum.now().timestamp())
+        if not self._count_scrobbles(context, lo, hi):
+            return None
+        precision = self.config["step_days"] * 24 * 60 * 60
+        while hi - lo > precision:
+            mid = (lo + hi) // 2
+            if self._count_scrobbles(context, int(start.timestamp()), mid):
+                hi = mid
+            else:
+                lo = mid
+        return pendulum.from_timestamp(lo)
+
+    def _is_caught_up(self, context: dict, start: DateTime) -> bool:
+        # whether a single window from the bookmark would reach the present
+        if not self.get_context_state(context).get("replication_key_value"):
+            return False
+        return start.add(days=self.config["step_days"]) > pendulum.now()
+
+    def _request_tail(self, context: dict, start: DateTime) -> Iterable[dict]:
+        """Request the scrobbles since the bookmark, newest first.
+
+        Scrobbles at the bookmark itself were written by the previous sync, so
+        they are skipped, and no further pages are requested once one is seen.
+        """
+        bookmark = int(start.timestamp())
+        page_token: Dict[str, Any] = {"from": str(bookmark), "page": 1}
+        while True:
+            response = self.request_page(context, page_token)
+            caught_up = False
+            for record in self.parse_response(response):
+                uts = record.get("date", {}).get("uts")
+                if uts is None:  # now playing
+                    continue
+                if int(uts) <= bookmark:
+                    caught_up = True
+                    continue
+                yield record
+            if caught_up or page_token["page"] >= self.get_total_pages(response):
+                return
+            page_token = {**page_token, "page": page_token["page"] + 1}
+
+    def _request_window(
+        self, context: dict, window: dict, resume: Optional[dict] = None
+    ) -> Generator[dict, None, Tuple[int, dict]]:
+        """Request a window's pages, yielding a ResumePoint after each.
+
+        Pages are newest first, so once a page is written, everything in the
+        window after its oldest scrobble has been. When resuming, only the
+        rest of the window is requested, and the scrobbles written at that
+        oldest time are skipped. Returns the number of scrobbles requested, as
+        the first page reports, and the part of the window they are from.
+        """
+        page_token = dict(window)
+        latest: Optional[str] = None
+        newest: Optional[int] = None
+        oldest: Optional[int] = None
+        oldest_names: Set[str] = set()
+        if resume:
+            latest = resume["latest"]
+            newest = oldest = int(resume["before"])
+            oldest_names = set(resume["seen"])
+            # one second on, in case `to` is exclusive
+            page_token["to"] = str(oldest + 1)
+        written_before, written_names = oldest, frozenset(oldest_names)
+
+        # the first page reports how many pages the window has, after which
+        # the rest can be requested together
+        first = self.request_page(context, page_token)
+        remaining = [
+            {**page_token, "page": page}
+            for page in range(2, self.get_total_pages(first) + 1)
+        ]
+        for response in itertools.chain(
+            [first], self.request_pages(context, remaining)
+        ):
+            for record in self.parse_response(response):
+                uts = record.get("date", {}).get("uts")
+                if uts is None:  # now playing
+                    yield record
+                    continue
+                uts = int(uts)
+                if written_before is not None and (
+                    uts > written_before
+                    or (uts == written_before and record.get("name") in written_names)
+                ):
+                    continue
+                if newest is None or uts > newest:
+                    newest, latest = uts, timestamp_to_rfc3339(uts)
+                if oldest is None or uts < oldest:
+                    oldest, oldest_names = uts, set()
+                if uts == oldest:
+                    oldest_names.add(record.get("name", ""))
+                yield record
+            if oldest is not None:
+                yield ResumePoint(
+                    {
+                        "from": window["from"],
+                        "to": window["to"],
+                        "before": str(oldest),
+                        "seen": sorted(oldest_names),
+                        "latest": latest,
+                    }
+                )
+        return self.get_total_records(first), page_token
+
+    def _request_window_oldest_first(
         self,
-        response: requests.Response,
-        previous_token: Optional[Any],
-    ) -> Optional[Any]:
-        """Return a token for identifying next page or None if no more pages."""
-        req_params = get_query_params(response.request)
-        prev_page = previous_token["page"] if previous_token else None
-        next_page = super().get_next_page_token(response, prev_page)
-        if next_page:
-            return {
-                "from": req_params["from"],
-                "to": req_params["to"],
-                "page": next_page,
+        context: dict,
+        window: dict,
+        written: Optional[Written],
+        seen: AbstractSet[str] = frozenset(),
+    ) -> Generator[dict, None, Tuple[int, Optional[Written]]]:
+        """Request a window's pages last to first, yielding each page reversed.
+
+        A CHECKPOINT is yielded after each page. Scrobbles already `written` are
+        skipped, as are those `seen` at the end of the window and any older
+        than those yielded before them, which would be out of order. Returns
+        the number of scrobbles in the window, as its first page reports, and
+        the newest scrobbles written.
+        """
+        # scrobbles made while the window is being requested would move the
+        # older ones onto the pages already requested
+        now = int(pendulum.now().timestamp())
+        page_token: Dict[str, Any] = {**window, "to": str(min(int(window["to"]), now))}
+        first = self.request_page(context, page_token)
+        remaining = [
+            {**page_token, "page": page}
+            for page in range(self.get_total_pages(first), 1, -1)
+        ]
+        skipped = 0
+        for response in itertools.chain(
+            self.request_pages(context, remaining), [first]
+        ):
+            for record in reversed(list(self.parse_response(response))):
+                uts = record.get("date", {}).get("uts")
+                if uts is None:  # now playing
+                    yield record
+                    continue
+                uts, name = int(uts), record.get("name", "")
+                if uts == int(window["to"]) and name in seen:
+                    continue
+                if written and uts < written[0]:
+                    skipped += 1
+                    continue
+                if written and uts == written[0]:
+                    if written[1] is None or name in written[1]:
+                        continue
+                    written[1].add(name)
+                else:
+                    written = (uts, {name})
+                yield record
+            # the bookmark is up to date, as the scrobbles are sorted
+            yield CHECKPOINT
+        if skipped:
+            self.logger.warning(
+                f"Skipped {skipped} scrobbles for [{context['username']}] from "
+                f"{window['from']} -> {window['to']} which were out of order"
+            )
+        return self.get_total_records(first), written
+
+    def _request_oldest_first(self, context: dict) -> Iterator[dict]:
+        """Request records window by window, each oldest first.
+
+        Every window up to the present is requested this way, including that
+        of users who are caught up, as newer scrobbles cannot be requested from
+        the bookmark onwards oldest first. A window left unfinished by an
+        interrupted newest first sync is finished first.
+        """
+        state = self.get_context_state(context)
+        resume = state.get("resume")
+        if resume:
+            yield from self._resume_oldest_first(context, resume)
+            latest = cast(DateTime, pendulum.parse(resume["latest"]))
+            start: Optional[DateTime] = latest
+            written: Optional[Written] = (int(latest.timestamp()), None)
+        else:
+            start = self._find_start(context)
+            # the scrobbles at the bookmark were written by a previous sync
+            written = written_in_state(state)
+        if start is None:
+            yield CHECKPOINT
+            return
+        page_token: Optional[dict] = self._page_token_for(start, 1)
+        while page_token:
+            total_records, written = yield from self._request_window_oldest_first(
+                context, page_token, written
+            )
+            page_token = self._next_window(page_token, total_records)
+
+    def _resume_oldest_first(self, context: dict, resume: dict) -> Iterator[dict]:
+        """Request the rest of a window a newest first sync left unfinished.
+
+        Everything in the window from its `before` time on was written, so
+        only the scrobbles older than that are requested, oldest first. Once
+        they are written, the bookmark moves on to the newest scrobble the
+        interrupted sync wrote.
+        """
+        self.logger.info(
+            f"Resuming scrobbles for [{context['username']}] from "
+            f"{resume['from']} -> {resume['before']}, oldest first"
+        )
+        window = {"from": resume["from"], "to": resume["before"], "page": 1}
+        written = written_in_state(self.get_context_state(context))
+        yield from self._request_window_oldest_first(
+            context, window, written, frozenset(resume["seen"])
+        )
+        yield StateUpdate(
+            {
+                "replication_key": self.replication_key,
+                "replication_key_value": resume["latest"],
             }
-        new_start = pendulum.from_timestamp(int(req_params["to"]))
-        if new_start > pendulum.now():
+        )
+        yield CHECKPOINT
+
+    def _find_start(self, context: dict) -> Optional[DateTime]:
+        """Return when to request scrobbles from, or `None` if there are none."""
+        start = self._start_time(context)
+        if not self.config.get("probe_history") or self.get_context_state(context).get(
+            "replication_key_value"
+        ):
+            return start
+        probed_start = self._probe_history(context, start)
+        if probed_start is None:
+            self.logger.info(f"No scrobbles found for [{context['username']}]")
             return None
-        self.finalize_state_progress_markers()  # emit state
-        return self._page_token_for(new_start, page=1)
+        if probed_start > start:
+            self.logger.info(
+                f"Skipping scrobbles for [{context['username']}] "
+                f"before {probed_start.to_date_string()}, there are none"
+            )
+        return probed_start
+
+    def request_records(self, context: Optional[dict]) -> Iterable[dict]:
+        """Request records window by window, yielding a CHECKPOINT after each.
+
+        Users whose bookmark is within one window of the present are instead
+        requested from the bookmark onwards, without an end to the window. A
+        window left unfinished by an interrupted sync is resumed first.
+        """
+        assert context is not None
+        if self.is_sorted:
+            yield from self._request_oldest_first(context)
+            return
+        resume = self.get_context_state(context).get("resume")
+        if resume:
+            self.logger.info(
+                f"Resuming scrobbles for [{context['username']}] from "
+                f"{resume['from']} -> {resume['to']} before {resume['before']}"
+            )
+            window = {"from": resume["from"], "to": resume["to"], "page": 1}
+        else:
+            start = self._find_start(context)
+            if start is None:
+                yield CHECKPOINT
+                return
+            if self._is_caught_up(context, start):
+                yield from self._request_tail(context, start)
+                yield CHECKPOINT
+                return
+            window = self._page_token_for(start, 1)
+        page_token: Optional[dict] = window
+        while page_token:
+            total_records, counted = yield from self._request_window(
+                context, page_token, resume
+            )
+            resume = None
+            yield CHECKPOINT
+            page_token = self._next_window(page_token, total_records, counted)
+
+    def get_cache_key(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> Optional[str]:
+        """Return the key to cache a page under, if its window is closed."""
+        if not context or not next_page_token or "to" not in next_page_token:
+            return None
+        closed_before = pendulum.now() - CLOSED_WINDOW_AGE
+        if int(next_page_token["to"]) >= closed_before.timestamp():
+            return None
+        return json.dumps(
+            [
+                self.method,
+                context["username"],
+                next_page_token["from"],
+                next_page_token["to"],
+                next_page_token["page"],
+                next_page_token.get("limit", str(self.page_size)),
+            ]
+        )
 
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[Any]
     ) -> Dict[str, Any]:
         """Return a dictionary of values to be used in URL parameterization."""
-        assert context is not None
-        if not next_page_token:
-            start_time = self._start_time(context)
-            next_page_token = self._page_token_for(start_time, 1)
+        # request_records always passes the window and page to request
+        assert context is not None and next_page_token
         self.logger.debug(
             f"fetching scrobbles for [{context['username']}] "
-            f"from {next_page_token['from']} -> {next_page_token['to']} "
+            f"from {next_page_token['from']} -> {next_page_token.get('to', 'now')} "
             f"page:{next_page_token['page']}"
         )
         return {
             **super().get_url_params(context, None),
-            **next_page_token,
             "extended": "1",
-            "limit": "200",
+            "limit": str(self.page_size),
+            **next_page_token,
         }
 
     def post_process(self, row: dict, context: Optional[dict] = None) -> Optional[dict]:
@@ -291,33 +877,308 @@ class ScrobblesStream(UserChildStream):
             return None
         return super().post_process(row, context)
 
+    def build_schema(self) -> dict:
+        """Return the schema, without the fields dropped from slim scrobbles."""
+        schema = super().build_schema()
+        if self.config.get("slim_scrobbles"):
+            properties = schema["properties"]
+            del properties["image"]
+            for name in SLIM_ARTIST_FIELDS:
+                del properties["artist"]["properties"][name]
+        return schema
+
+    def get_records(  # type: ignore[override]
+        self, context: Optional[dict]
+    ) -> Iterable[Tuple[Dict[str, Any], dict]]:
+        """Return records along with the artist and album for dimension streams."""
+        assert context is not None
+        slim = self.config.get("slim_scrobbles")
+        for record in super().get_records(context):
+            child_context = {
+                "artist": record["artist"],
+                "album": record["album"],
+                "image": record["image"],
+            }
+            if slim:
+                record = {
+                    **record,
+                    "artist": {
+                        k: v
+                        for k, v in record["artist"].items()
+                        if k not in SLIM_ARTIST_FIELDS
+                    },
+                }
+                del record["image"]
+            yield record, child_context
+
+    def get_child_context(self, record: dict, context: Optional[dict]) -> dict:
+        """Return the context given alongside the record by `get_records`."""
+        assert context is not None
+        return context
+
+    def _sync_children(self, child_context: dict) -> None:
+        # dimension streams only keep track of what they have seen, rather
+        # than making requests of their own for each scrobble
+        for child_stream in self.child_streams:
+            if child_stream.selected:
+                cast(DimensionStream, child_stream).observe(child_context)
+
+
+class DimensionStream(BufferedOutputStream):
+    """Base stream of entities seen in scrobbles, such as artists.
+
+    Rather than being synced like other child streams, each scrobble's
+    entity is written the first time it is seen. A bounded set of recently
+    seen entities is kept, so an entity may be written more than once if it
+    is seen again after many others.
+    """
+
+    parent_stream_type = ScrobblesStream
+    state_partitioning_keys: List[str] = []
+
+    def __init__(self, *args, **kwargs):
+        """Construct a DimensionStream."""
+        super().__init__(*args, **kwargs)
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._wrote_schema = False
+
+    def get_entity(self, context: dict) -> Optional[dict]:
+        """Return the entity from a scrobble's context, or None if it has none."""
+        raise NotImplementedError()
+
+    def get_entity_key(self, entity: dict) -> Hashable:
+        """Return the value identifying an entity."""
+        return tuple(entity[k] for k in self.primary_keys or [])
+
+    def observe(self, context: dict) -> None:
+        """Write the entity in a scrobble's context, unless recently written."""
+        entity = self.get_entity(context)
+        if entity is None:
+            return
+        key = self.get_entity_key(entity)
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return
+        self._seen[key] = None
+        if len(self._seen) > self.config.get("dimension_cache_size", 10000):
+            self._seen.popitem(last=False)
+        if not self._wrote_schema:
+            self._write_schema_message()
+            self._wrote_schema = True
+        self._write_record_message(dict(entity))
+
+    def get_records(self, context: Optional[dict]) -> Iterable[Dict[str, Any]]:
+        """Return no records, as they are written while scrobbles are synced."""
+        return []
+
+
+class ArtistsStream(DimensionStream):
+    """Stream of the artists of scrobbled tracks."""
+
+    name = "artists"
+    primary_keys = ["name"]
+    schema = th.PropertiesList(
+        th.Property("name", th.StringType),
+        th.Property(
+            "mbid", th.StringType, description="The MusicBrainz artist ID, if known."
+        ),
+        th.Property("url", th.StringType),
+        th.Property(
+            "image",
+            th.ObjectType(*[th.Property(size, th.StringType) for size in IMAGE_SIZES]),
+        ),
+    ).to_dict()
+
+    def get_entity(self, context: dict) -> Optional[dict]:
+        """Return the artist of a scrobble."""
+        artist = context["artist"]
+        return artist if artist.get("name") else None
+
+
+class AlbumsStream(DimensionStream):
+    """Stream of the albums of scrobbled tracks."""
+
+    name = "albums"
+    primary_keys = ["artist_name", "name"]
+    schema = th.PropertiesList(
+        th.Property("artist_name", th.StringType),
+        th.Property("name", th.StringType),
+        th.Property(
+            "mbid", th.StringType, description="The MusicBrainz release ID, if known."
+        ),
+        th.Property(
+            "image",
+            th.ObjectType(*[th.Property(size, th.StringType) for size in IMAGE_SIZES]),
+            description="The album art, as shown for scrobbles of its tracks",
+        ),
+    ).to_dict()
+
+    def get_entity(self, context: dict) -> Optional[dict]:
+        """Return the album of a scrobble."""
+        album = context["album"]
+        if not album.get("name"):
+            return None
+        return {
+            "artist_name": context["artist"].get("name"),
+            **album,
+            "image": context["image"],
+        }
+
+
+class CountedStream(UserChildStream):
+    """Base stream of a user's records, which are only requested if they changed.
+
+    A single record is requested first, whose page reports how many records
+    the user has. If that is the count kept in the partition's state as
+    `total` by the last sync, nothing more is requested for the user. The
+    count is only kept once the user's records have been written.
+    """
+
+    page_size = 200
+
+    def has_changed(self, context: dict, probe: requests.Response) -> bool:
+        """Return whether the user's records changed since the last sync."""
+        total = self.get_total_records(probe)
+        return self.get_context_state(context).get("total") != total
+
+    def request_changed(self, context: dict) -> Iterable[dict]:
+        """Request the user's records, knowing they have changed."""
+        raise NotImplementedError
+
+    def request_records(self, context: Optional[dict]) -> Iterable[dict]:
+        """Request the user's records, unless their count is unchanged."""
+        assert context is not None
+        probe = self.request_page(context, {"page": 1, "limit": "1"})
+        total = self.get_total_records(probe)
+        if self.has_changed(context, probe):
+            if total:
+                yield from self.request_changed(context)
+            yield StateUpdate(total=total)
+        else:
+            self.logger.info(
+                f"Skipping {self.name} for [{context['username']}], "
+                f"still {total} since the last sync"
+            )
+        yield CHECKPOINT
+
+    def get_url_params(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> Dict[str, Any]:
+        """Return a dictionary of values to be used in URL parameterization."""
+        return {
+            **super().get_url_params(context, None),
+            "limit": str(self.page_size),
+            **(next_page_token or {"page": 1}),
+        }
+
+
+class LovedTracksStream(CountedStream):
+    """Stream of the tracks a user loves."""
+
+    name = "loved_tracks"
+    method = "user.getLovedTracks"
+    primary_keys = ["username", "date", "name"]
+    replication_key = "date"
+    records_jsonpath = "$.lovedtracks.track[*]"
+    total_pages_jsonpath = '$.lovedtracks["@attr"].totalPages'
+    total_records_jsonpath = '$.lovedtracks["@attr"].total'
+    skips_written = True
+    properties = th.PropertiesList(
+        Property("name", th.StringType, description="The name of the track"),
+        Property(
+            "mbid",
+            th.StringType,
+            description="The MusicBrainz recording ID, if known",
+            cast=blank_to_null,
+        ),
+        Property("url", th.StringType),
+        Property(
+            "date",
+            th.DateTimeType,
+            description="The time the track was loved",
+            jsonpath_selector="$.date.uts",
+            cast=timestamp_to_rfc3339,
+        ),
+        Property("username", th.StringType),
+        Property(
+            "artist",
+            th.ObjectType(
+                Property("name", th.StringType, jsonpath_selector="$.artist.name"),
+                Property(
+                    "mbid",
+                    th.StringType,
+                    jsonpath_selector="$.artist.mbid",
+                    description="The MusicBrainz artist ID, if known.",
+                    cast=blank_to_null,
+                ),
+                Property("url", th.StringType, jsonpath_selector="$.artist.url"),
+            ),
+        ),
+        IMAGE_PROPERTY,
+    )
+
+    def _bookmark(self, context: dict) -> Optional[int]:
+        start = self.get_starting_timestamp(context)
+        return int(start.timestamp()) if start else None
+
+    def has_changed(self, context: dict, probe: requests.Response) -> bool:
+        """Return whether the count or the newest loved track changed.
+
+        A track may have been unloved and another loved since the last sync,
+        which leaves the count as it was.
+        """
+        if super().has_changed(context, probe):
+            return True
+        bookmark = self._bookmark(context)
+        return any(
+            bookmark is None or int(record["date"]["uts"]) > bookmark
+            for record in self.parse_response(probe)
+        )
+
+    def request_changed(self, context: dict) -> Iterable[dict]:
+        """Request loved tracks newest first, until reaching the bookmark.
+
+        Tracks loved at the bookmark itself are requested again, to be skipped
+        if they were written already.
+        """
+        bookmark = self._bookmark(context)
+        page = 1
+        while True:
+            response = self.request_page(context, {"page": page})
+            for record in self.parse_response(response):
+                if bookmark is not None and int(record["date"]["uts"]) < bookmark:
+                    return
+                yield record
+            if page >= self.get_total_pages(response):
+                return
+            page += 1
+
+
+class FriendsStream(CountedStream):
+    """Stream of the friends of each user, as a join table of usernames.
+
+    Friends are in the users stream if they are configured as users too.
+    """
+
+    name = "friends"
+    method = "user.getFriends"
+    primary_keys = ["username", "friend_username"]
+    replication_method = "FULL_TABLE"
+    records_jsonpath = "$.friends.user[*]"
+    total_pages_jsonpath = '$.friends["@attr"].totalPages'
+    total_records_jsonpath = '$.friends["@attr"].total'
+    properties = th.PropertiesList(
+        Property("username", th.StringType),
+        Property("friend_username", th.StringType, jsonpath_selector="$.name"),
+    )
 
-# TODO: it would make more sense to emit a row on the users stream, then
-# make the friends stream a simple join table. However, the SDK doesn't
-# allow this sort of imperative behavior.
-# class FriendsStream(UserChildStream):
-#     """Stream of friends of the user."""
-
-#     name = "friends"
-#     method = "user.getFriends"
-#     primary_keys = ["username", "friend_username"]
-#     records_jsonpath = "$.friends.user[*]"
-#     total_pages_jsonpath = '$.friends["@attr"].totalPages'
-#     is_sorted = False
-#     replication_method = "FULL_TABLE"
-#     properties = th.PropertiesList(
-#         Property("username", th.StringType),
-#         Property("friend_username", th.StringType, jsonpath_selector="$.name"),
-#         *USER_PROPERTIES,
-#     )
-
-#     def get_url_params(
-#         self, context: Optional[dict], next_page_token: Optional[Any]
-#     ) -> Dict[str, Any]:
-#         return {
-#             **super().get_url_params(context, None),
-#             "recenttracks": "0",
-#             "limit": "200",
-#         }
-
-# LovedTracksStream - requires some manual incremental logic
+    def request_changed(self, context: dict) -> Iterable[dict]:
+        """Request every page of the user's friends."""
+        first = self.request_page(context, {"page": 1})
+        remaining = [
+            {"page": page} for page in range(2, self.get_total_pages(first) + 1)
+        ]
+        for response in itertools.chain(
+            [first], self.request_pages(context, remaining)
+        ):
+            yield from self.parse_response(response)
@@ -1,15 +1,35 @@
 """LastFM tap class."""
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Type
 
 from singer_sdk import Stream, Tap
 from singer_sdk import typing as th  # JSON schema typing helpers
 
-from tap_lastfm.streams import ScrobblesStream, UsersStream
+from tap_lastfm.api_keys import KeyPool
+from tap_lastfm.cache import ResponseCache
+from tap_lastfm.metrics import Metrics
+from tap_lastfm.output import MessageWriter
+from tap_lastfm.sharding import filter_state, select_shard
+from tap_lastfm.streams import (
+    AlbumsStream,
+    ArtistsStream,
+    FriendsStream,
+    LovedTracksStream,
+    ScrobblesStream,
+    UsersStream,
+)
+from tap_lastfm.transport import PooledSession
+
+CACHE_MODES = ["use", "refresh", "bypass"]
 
-STREAM_TYPES = [
+STREAM_TYPES: List[Type[Stream]] = [
     UsersStream,
     ScrobblesStream,
+    ArtistsStream,
+    AlbumsStream,
+    LovedTracksStream,
+    FriendsStream,
 ]
 
 
@@ -25,12 +45,33 @@ class TapLastFM(Tap):
             required=True,
             description="The API key to authenticate against the API service",
         ),
+        th.Property(
+            "api_keys",
+            th.ArrayType(th.StringType),
+            description=(
+                "Further API keys to spread requests across, each allowed "
+                "requests_per_second"
+            ),
+        ),
         th.Property(
             "usernames",
             th.ArrayType(th.StringType),
             required=True,
             description="The usernames of users to fetch scrobble data for",
         ),
+        th.Property(
+            "shard_count",
+            th.IntegerType,
+            description="The number of tap processes the usernames are split "
+            "between",
+            default=1,
+        ),
+        th.Property(
+            "shard_index",
+            th.IntegerType,
+            description="Which of the shard_count tap processes this is, from 0",
+            default=0,
+        ),
         th.Property(
             "user_agent",
             th.StringType,
@@ -48,8 +89,295 @@ class TapLastFM(Tap):
             description="The number of days to scan through before emitting state",
             default=30,
         ),
+        th.Property(
+            "target_pages_per_window",
+            th.IntegerType,
+            description=(
+                "If set, size each time window after the first to hold about this "
+                "many pages of scrobbles, based on how many the previous window had, "
+                "instead of using a fixed step_days"
+            ),
+        ),
+        th.Property(
+            "probe_history",
+            th.BooleanType,
+            description=(
+                "When a user has no bookmark yet, first search for their earliest "
+                "scrobble rather than stepping through every window since they "
+                "registered"
+            ),
+            default=False,
+        ),
+        th.Property(
+            "skip_unchanged_users",
+            th.BooleanType,
+            description=(
+                "Skip requesting scrobbles for users whose playcount is the same "
+                "as at the end of the last sync"
+            ),
+            default=True,
+        ),
+        th.Property(
+            "dimension_cache_size",
+            th.IntegerType,
+            description=(
+                "The number of artists and albums to remember having written, so "
+                "each is written only once rather than for every scrobble"
+            ),
+            default=10000,
+        ),
+        th.Property(
+            "sorted_scrobbles",
+            th.BooleanType,
+            description=(
+                "Write each user's scrobbles oldest first, and keep their bookmark "
+                "up to date after every page"
+            ),
+            default=False,
+        ),
+        th.Property(
+            "slim_scrobbles",
+            th.BooleanType,
+            description=(
+                "Leave the artist's URL and images and the track's images out of "
+                "scrobbles, as they are in the artists and albums streams"
+            ),
+            default=False,
+        ),
+        th.Property(
+            "max_concurrent_user_info",
+            th.IntegerType,
+            description=(
+                "The number of users to request info for in parallel. Users are "
+                "still written in the order they are configured"
+            ),
+            default=4,
+        ),
+        th.Property(
+            "max_concurrent_users",
+            th.IntegerType,
+            description=(
+                "The number of users to fetch data for in parallel. Records are "
+                "still written one partition at a time"
+            ),
+            default=1,
+        ),
+        th.Property(
+            "max_concurrent_pages",
+            th.IntegerType,
+            description=(
+                "The number of pages of a time window to fetch in parallel, once "
+                "the first page has reported how many there are"
+            ),
+            default=1,
+        ),
+        th.Property(
+            "connection_pool_size",
+            th.IntegerType,
+            description=(
+                "The number of connections to Last.fm to keep open. Defaults to "
+                "enough for every request which may be made in parallel"
+            ),
+        ),
+        th.Property(
+            "fast_output",
+            th.BooleanType,
+            description=(
+                "Write messages in large chunks, serialising records without the "
+                "SDK's checks against the schema"
+            ),
+            default=False,
+        ),
+        th.Property(
+            "requests_per_second",
+            th.NumberType,
+            description=(
+                "The most requests to send per second with each API key. Last.fm "
+                "asks for no more than 5, averaged over 5 minutes"
+            ),
+            default=5,
+        ),
+        th.Property(
+            "request_burst",
+            th.IntegerType,
+            description="The number of requests which may be sent back to back",
+            default=5,
+        ),
+        th.Property(
+            "metrics",
+            th.BooleanType,
+            description=(
+                "Log how long is spent on requests, retries, decoding, mapping and "
+                "writing records, per stream and user"
+            ),
+            default=False,
+        ),
+        th.Property(
+            "metrics_log_interval",
+            th.IntegerType,
+            description="How often to log metrics, in seconds",
+            default=60,
+        ),
+        th.Property(
+            "cache_path",
+            th.StringType,
+            description=(
+                "If set, a file to cache pages of scrobbles in once they can no "
+                "longer change, so they need not be requested again"
+            ),
+        ),
+        th.Property(
+            "cache_max_mb",
+            th.IntegerType,
+            description="The most compressed data to keep in the cache, in MiB",
+            default=1024,
+        ),
+        th.Property(
+            "cache_mode",
+            th.StringType,
+            description=(
+                "'use' to read from and write to the cache, 'refresh' to request "
+                "every page again and replace what is cached, or 'bypass' to "
+                "ignore the cache"
+            ),
+            default="use",
+        ),
     ).to_dict()
 
+    _requests_session: Optional[PooledSession] = None
+    _page_executor: Optional[ThreadPoolExecutor] = None
+    _api_keys: Optional[KeyPool] = None
+    _response_cache: Optional[ResponseCache] = None
+    _metrics: Optional[Metrics] = None
+    _output_writer: Optional[MessageWriter] = None
+
+    _usernames: Optional[List[str]] = None
+
+    @property
+    def usernames(self) -> List[str]:
+        """Return the configured usernames which belong to this tap's shard."""
+        if self._usernames is None:
+            shard_count = self.config.get("shard_count", 1)
+            self._usernames = select_shard(
+                self.config["usernames"],
+                self.config.get("shard_index", 0),
+                shard_count,
+            )
+            if shard_count > 1:
+                self.logger.info(
+                    f"Syncing {len(self._usernames)} of "
+                    f"{len(self.config['usernames'])} users in this shard"
+                )
+        return self._usernames
+
+    @property
+    def requests_session(self) -> PooledSession:
+        """Return the HTTP session shared by all streams."""
+        if self._requests_session is None:
+            self._requests_session = PooledSession(
+                pool_size=self.config.get("connection_pool_size")
+                or self.max_concurrent_requests,
+                logger=self.logger,
+            )
+        return self._requests_session
+
+    @property
+    def max_concurrent_requests(self) -> int:
+        """Return the most requests which may be in flight at once."""
+        return (
+            self.config.get("max_concurrent_user_info", 4)
+            + self.config.get("max_concurrent_users", 1)
+            + self.config.get("max_concurrent_pages", 1)
+        )
+
+    @property
+    def page_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool used to fetch pages, shared by all streams."""
+        if self._page_executor is None:
+            self._page_executor = ThreadPoolExecutor(
+                max_workers=self.config.get("max_concurrent_pages", 1),
+                thread_name_prefix="tap-lastfm-pages",
+            )
+        return self._page_executor
+
+    @property
+    def api_keys(self) -> KeyPool:
+        """Return the API keys, each with its own rate limit, shared by all streams."""
+        if self._api_keys is None:
+            self._api_keys = KeyPool(
+                [self.config["api_key"], *self.config.get("api_keys", [])],
+                max_rate=self.config.get("requests_per_second", 5),
+                burst=self.config.get("request_burst", 5),
+                logger=self.logger,
+            )
+        return self._api_keys
+
+    @property
+    def metrics(self) -> Metrics:
+        """Return the collector of timings shared by all streams."""
+        if self._metrics is None:
+            self._metrics = Metrics(
+                enabled=self.config.get("metrics", False),
+                logger=self.logger,
+                log_interval=self.config.get("metrics_log_interval", 60),
+            )
+        return self._metrics
+
+    @property
+    def output_writer(self) -> Optional[MessageWriter]:
+        """Return the buffered writer of messages shared by all streams, if enabled."""
+        if not self.config.get("fast_output"):
+            return None
+        if self._output_writer is None:
+            self._output_writer = MessageWriter()
+        return self._output_writer
+
+    @property
+    def response_cache(self) -> Optional[ResponseCache]:
+        """Return the response cache shared by all streams, if configured."""
+        path = self.config.get("cache_path")
+        mode = self.config.get("cache_mode", "use")
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache_mode {mode!r}, expected one of {CACHE_MODES}"
+            )
+        if not path or mode == "bypass":
+            return None
+        if self._response_cache is None:
+            self._response_cache = ResponseCache(
+                path,
+                max_bytes=self.config.get("cache_max_mb", 1024) * 2**20,
+                refresh=mode == "refresh",
+                logger=self.logger,
+            )
+        return self._response_cache
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Load the state, keeping only the partitions of this shard's users."""
+        super().load_state(state)
+        filter_state(
+            self.state,
+            self.config.get("shard_index", 0),
+            self.config.get("shard_count", 1),
+        )
+
+    def sync_all(self) -> None:  # type: ignore[misc]
+        """Sync all streams, then report on the run."""
+        try:
+            super().sync_all()
+        finally:
+            if self._output_writer is not None:
+                self._output_writer.flush()
+            if self._response_cache is not None:
+                self._response_cache.close()
+                self._response_cache = None
+            if self._page_executor is not None:
+                self._page_executor.shutdown()
+                self._page_executor = None
+        self.api_keys.log_summary()
+        self.requests_session.log_summary()
+        self.metrics.log_summary()
+
     def discover_streams(self) -> List[Stream]:
         """Return a list of discovered streams."""
         return [stream_class(tap=self) for stream_class in STREAM_TYPES]
@@ -0,0 +1,216 @@
+r"""Benchmark a full sync against a local fake Last.fm API.
+
+Run with, for example::
+
+    python -m tap_lastfm.tests.benchmark --users 4 --scrobbles 20000 \
+        --latency 0.05 --config '{"max_concurrent_users": 4}'
+
+The fake API runs in a separate process, so that the CPU time and memory
+reported are the tap's own. With `--startup`, the time taken to import the
+tap and discover its streams is measured instead, in fresh processes.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+import requests
+
+from tap_lastfm.client import LastFMStream
+from tap_lastfm.property_stream import PropertyStream
+from tap_lastfm.tap import TapLastFM
+from tap_lastfm.tests.fake_lastfm import FakeLastFM
+
+
+class RecordCounter:
+    """A stand-in for stdout which counts and discards Singer messages."""
+
+    def __init__(self) -> None:
+        """Start counting from nothing."""
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, data: str) -> int:
+        """Count the records in `data`, returning its length as a file would."""
+        # messages are written one at a time, or in chunks with fast_output
+        self.records += data.count('"type": "RECORD"') + data.count('"type":"RECORD"')
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        """Do nothing, as nothing is buffered."""
+
+
+def peak_rss_bytes() -> int:
+    """Return the most memory this process has had resident, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, but bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 2**10
+
+
+def _serve(kwargs: Dict[str, Any], conn) -> None:
+    fake = FakeLastFM(**kwargs).start()
+    conn.send(fake.url)
+    # serve until the benchmark is done
+    conn.recv()
+    fake.stop()
+
+
+def run_benchmark(
+    usernames: List[str], fake_kwargs: Dict[str, Any], config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Sync every stream for the given users and measure the run."""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=_serve, args=({"usernames": usernames, **fake_kwargs}, child_conn)
+    )
+    server.start()
+    url = parent_conn.recv()
+
+    post_process_seconds = 0.0
+    original_post_process = PropertyStream.post_process
+
+    def timed_post_process(self, row, context=None):
+        nonlocal post_process_seconds
+        started = time.thread_time()
+        try:
+            return original_post_process(self, row, context)
+        finally:
+            post_process_seconds += time.thread_time() - started
+
+    output = RecordCounter()
+    tap = TapLastFM(
+        config={
+            "api_key": "benchmark",
+            "usernames": usernames,
+            "requests_per_second": 1000,
+            **config,
+        },
+        parse_env_config=False,
+    )
+    try:
+        with mock.patch.object(LastFMStream, "url_base", url), mock.patch.object(
+            PropertyStream, "post_process", timed_post_process
+        ), contextlib.redirect_stdout(
+            output
+        ):  # type: ignore[type-var]
+            started, cpu_started = time.perf_counter(), time.process_time()
+            tap.sync_all()
+            elapsed = time.perf_counter() - started
+            cpu_seconds = time.process_time() - cpu_started
+        stats = requests.get(f"{url}/stats").json()
+    finally:
+        parent_conn.send("stop")
+        server.join()
+
+    return {
+        "records": output.records,
+        "requests": stats["requests"],
+        "injected_errors": stats["errors"],
+        "output_mb": output.bytes / 2**20,
+        "seconds": elapsed,
+        "records_per_second": output.records / elapsed,
+        "requests_per_second": stats["requests"] / elapsed,
+        "cpu_seconds": cpu_seconds,
+        "post_process_cpu_seconds": post_process_seconds,
+        "peak_rss_mb": peak_rss_bytes() / 2**20,
+    }
+
+
+# Run in a fresh interpreter, so that nothing is imported already
+_STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+from tap_lastfm.tap import TapLastFM
+imported = time.perf_counter()
+config = {"api_key": "benchmark", "usernames": ["benchmark"]}
+tap = TapLastFM(config=config, parse_env_config=False)
+tap.catalog_json_text
+discovered = time.perf_counter()
+print(json.dumps([imported - started, discovered - imported]))
+"""
+
+
+def run_startup_benchmark(runs: int) -> Dict[str, Any]:
+    """Measure importing the tap and discovering its streams, from cold."""
+    import_seconds, discover_seconds = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SCRIPT],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout
+        imported, discovered = json.loads(output)
+        import_seconds.append(imported)
+        discover_seconds.append(discovered)
+    return {
+        "runs": runs,
+        "import_ms": statistics.median(import_seconds) * 1000,
+        "discover_ms": statistics.median(discover_seconds) * 1000,
+    }
+
+
+def main() -> None:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2, help="number of users")
+    parser.add_argument(
+        "--scrobbles", type=int, default=10000, help="scrobbles per user"
+    )
+    parser.add_argument(
+        "--history-days", type=int, default=365, help="days since users registered"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds to answer each request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of requests to fail"
+    )
+    parser.add_argument(
+        "--config", type=json.loads, default={}, help="tap config, as JSON"
+    )
+    parser.add_argument(
+        "--startup",
+        type=int,
+        metavar="RUNS",
+        help="measure startup instead, as the median of this many runs",
+    )
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = run_startup_benchmark(args.startup)
+    else:
+        results = run_benchmark(
+            [f"user{i}" for i in range(args.users)],
+            {
+                "scrobbles": args.scrobbles,
+                "history_days": args.history_days,
+                "latency": args.latency,
+                "error_rate": args.error_rate,
+            },
+            args.config,
+        )
+    if args.json:
+        json.dump(results, sys.stdout)
+        print()
+        return
+    for name, value in results.items():
+        print(
+            f"{name:>26}: {value:.2f}"
+            if isinstance(value, float)
+            else f"{name:>26}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""A clock for offline tests, which only moves when told to."""
+
+
+class FakeClock:
+    """Stands in for a monotonic clock, and for sleeping on it."""
+
+    def __init__(self) -> None:
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Move the clock on, instead of waiting."""
+        self.now += seconds
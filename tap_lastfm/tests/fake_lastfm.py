@@ -0,0 +1,231 @@
+"""A local stand-in for the Last.fm API, serving generated data."""
+
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from tap_lastfm.tests.samples import make_loved_track, make_track, make_user
+
+# the error code and body Last.fm responds with when requests are too frequent
+RATE_LIMIT_EXCEEDED = {
+    "error": 29,
+    "message": "Rate Limit Exceeded - Your IP has made too many requests in a short "
+    "period",
+}
+
+
+class FakeLastFM:
+    """Serves the `user` methods the tap calls, for generated users.
+
+    Each user has `scrobbles` scrobbles spread evenly between their
+    registration `history_days` ago and now, so any time window and page of
+    them can be computed without storing them. They love their oldest `loved`
+    tracks, at the time they scrobbled them, and have `friends` friends.
+    """
+
+    def __init__(
+        self,
+        usernames: List[str],
+        scrobbles: int = 1000,
+        history_days: int = 365,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        invalid_keys: Iterable[str] = (),
+        loved: int = 0,
+        friends: int = 0,
+    ) -> None:
+        """Create a server for the given users.
+
+        Each request waits `latency` seconds before it is answered, and an
+        `error_rate` fraction of them, chosen with `seed`, fail with a rate
+        limit or internal server error. Requests with any of `invalid_keys`
+        are rejected as if the key were invalid.
+        """
+        self.usernames = set(usernames)
+        self.scrobbles = scrobbles
+        self.now = int(time.time())
+        self.registered = self.now - history_days * 24 * 60 * 60
+        self.latency = latency
+        self.error_rate = error_rate
+        self.invalid_keys = set(invalid_keys)
+        self.loved = loved
+        self.friends = friends
+        # the times of the scrobbles, if not spread evenly
+        self.times: Optional[List[int]] = None
+        self.request_count = 0
+        self.error_count = 0
+        # the number of requests made with each API key
+        self.key_counts: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        """Return the base URL the server is listening on."""
+        assert self._server is not None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLastFM":
+        """Start serving on a free local port, on a background thread."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive between requests
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                status, body = fake.respond(self.path)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    data = gzip.compress(data, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self) -> dict:
+        """Return the numbers of requests answered and failed on purpose."""
+        return {"requests": self.request_count, "errors": self.error_count}
+
+    def set_scrobble_times(self, times: Iterable[int]) -> None:
+        """Give each user scrobbles at `times`, instead of spread evenly."""
+        self.times = sorted(times)
+        self.scrobbles = len(self.times)
+
+    def scrobble_time(self, index: int) -> int:
+        """Return the time of a user's scrobble, counting from the oldest."""
+        if self.times is not None:
+            return self.times[index]
+        span = self.now - self.registered
+        return self.registered + (index + 1) * span // (self.scrobbles + 1)
+
+    def respond(self, path: str) -> tuple:
+        """Return the status code and body to answer a request with."""
+        if path == "/stats":
+            return 200, self.stats()
+        params = {k: v[0] for k, v in parse_qs(urlparse(path).query).items()}
+        api_key = params.get("api_key", "")
+        with self._lock:
+            self.request_count += 1
+            self.key_counts[api_key] = self.key_counts.get(api_key, 0) + 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.error_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if api_key in self.invalid_keys:
+            return 403, {"error": 10, "message": "Invalid API key"}
+        if fail:
+            if self.error_count % 2:
+                return 429, RATE_LIMIT_EXCEEDED
+            return 500, {"error": 16, "message": "Temporary error"}
+        method = params.get("method", "").lower()
+        if params.get("user") not in self.usernames:
+            return 404, {"error": 6, "message": "User not found"}
+        if method == "user.getinfo":
+            return 200, {
+                "user": make_user(params["user"], self.registered, self.scrobbles)
+            }
+        lists = {
+            "user.getrecenttracks": self.recent_tracks,
+            "user.getlovedtracks": self.loved_tracks,
+            "user.getfriends": self.user_friends,
+        }
+        if method in lists:
+            return 200, lists[method](params)
+        return 400, {"error": 3, "message": "Invalid Method"}
+
+    def recent_tracks(self, params: Dict[str, str]) -> dict:
+        """Return a page of scrobbles, newest first."""
+        start = int(params.get("from", 0))
+        end = int(params.get("to", self.now))
+        limit = int(params.get("limit", 50))
+        page = int(params.get("page", 1))
+        # the range of indexes of scrobbles within the window
+        first = self._bisect(start)
+        last = self._bisect(end + 1)
+        total = max(0, last - first)
+        newest = last - (page - 1) * limit
+        indexes = range(newest - 1, max(first, newest - limit) - 1, -1)
+        tracks = [
+            make_track(
+                self.scrobble_time(i), name=f"Track {i}", artist=f"Artist {i % 97}"
+            )
+            for i in indexes
+        ]
+        return {
+            "recenttracks": {
+                "track": tracks,
+                "@attr": {
+                    "user": params["user"],
+                    "totalPages": str(-(-total // limit)),
+                    "page": str(page),
+                    "perPage": str(limit),
+                    "total": str(total),
+                },
+            }
+        }
+
+    def loved_tracks(self, params: Dict[str, str]) -> dict:
+        """Return a page of loved tracks, newest first."""
+        tracks = [
+            make_loved_track(self.scrobble_time(i), name=f"Track {i}")
+            for i in range(self.loved - 1, -1, -1)
+        ]
+        return {"lovedtracks": self._page(tracks, "track", params)}
+
+    def user_friends(self, params: Dict[str, str]) -> dict:
+        """Return a page of friends."""
+        friends = [make_user(f"friend{i}") for i in range(self.friends)]
+        return {"friends": self._page(friends, "user", params)}
+
+    def _page(self, items: list, key: str, params: Dict[str, str]) -> dict:
+        # a page of a list of items, with the same @attr as recent tracks
+        limit = int(params.get("limit", 50))
+        page = int(params.get("page", 1))
+        skipped = (page - 1) * limit
+        return {
+            key: items[skipped:][:limit],
+            "@attr": {
+                "user": params["user"],
+                "totalPages": str(-(-len(items) // limit)),
+                "page": str(page),
+                "perPage": str(limit),
+                "total": str(len(items)),
+            },
+        }
+
+    def _bisect(self, timestamp: int) -> int:
+        # the index of the first scrobble at or after the timestamp
+        lo, hi = 0, self.scrobbles
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.scrobble_time(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
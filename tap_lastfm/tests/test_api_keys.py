@@ -0,0 +1,37 @@
+"""Tests for spreading requests across API keys."""
+
+from tap_lastfm.api_keys import KeyPool
+from tap_lastfm.tests.fake_clock import FakeClock
+
+
+def make_pool(*keys: str, rate: float = 5, burst: int = 1) -> KeyPool:
+    clock = FakeClock()
+    return KeyPool(keys, rate, burst=burst, clock=clock, sleep=clock.sleep)
+
+
+def test_spreads_requests_evenly_across_keys():
+    pool = make_pool("a", "b", "c", "a")
+    acquired = [pool.acquire() for _ in range(30)]
+    keys = [key for key, _ in acquired]
+    assert [keys.count(k) for k in "abc"] == [10, 10, 10]
+    # three keys at 5 requests per second each
+    assert sum(waited for _, waited in acquired) < 30 / 15
+
+
+def test_benches_rate_limited_and_rejected_keys():
+    pool = make_pool("a", "b")
+    pool.rate_limited("a")
+    assert {pool.acquire()[0] for _ in range(10)} == {"b"}
+    # "a" is only rate limited, so may still be used
+    assert pool.rejected("b")
+
+    # once every key is benched, the first to come back is used
+    assert pool.acquire()[0] == "a"
+    assert not pool.rejected("a")
+
+
+def test_never_benches_a_single_key():
+    pool = make_pool("a")
+    pool.rate_limited("a")
+    assert pool.keys[0].limiter.rate == 2.5
+    assert pool.acquire() == ("a", 0.4)
@@ -0,0 +1,62 @@
+"""Tests for the on-disk response cache."""
+
+import os
+
+from tap_lastfm.cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+def make_cache(tmp_path, max_bytes=2**20, refresh=False) -> ResponseCache:
+    return ResponseCache(
+        str(tmp_path / "cache.db"), max_bytes, refresh=refresh, clock=FakeClock()
+    )
+
+
+def test_stores_responses_across_runs(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get("a") is None
+    cache.put("a", b'{"recenttracks": {}}')
+    assert cache.get("a") == b'{"recenttracks": {}}'
+    cache.close()
+
+    cache = make_cache(tmp_path)
+    assert cache.get("a") == b'{"recenttracks": {}}'
+    assert cache.size > 0
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_refresh_replaces_without_reading(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("a", b"old")
+    cache.close()
+
+    cache = make_cache(tmp_path, refresh=True)
+    assert cache.get("a") is None
+    cache.put("a", b"new")
+    cache.close()
+
+    assert make_cache(tmp_path).get("a") == b"new"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # random bodies do not compress, so each entry is slightly over 1000 bytes
+    bodies = {key: os.urandom(1000) for key in "abc"}
+    cache = make_cache(tmp_path, max_bytes=2500)
+    cache.put("a", bodies["a"])
+    cache.put("b", bodies["b"])
+    assert cache.get("a") == bodies["a"]
+    cache.put("c", bodies["c"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == bodies["a"]
+    assert cache.get("c") == bodies["c"]
+    assert cache.evicted == 1
+    assert cache.size <= 2500
@@ -0,0 +1,50 @@
+"""Tests for the stage timings and counters."""
+
+import logging
+
+from tap_lastfm.metrics import DECODE, NETWORK, RECORDS, Metrics
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_nested_stages_are_timed_exclusively():
+    clock = FakeClock()
+    metrics = Metrics(enabled=True, clock=clock)
+    with metrics.timer(NETWORK, "scrobbles", "alice"):
+        clock.now += 1
+        with metrics.timer(DECODE, "scrobbles"):
+            clock.now += 0.25
+    assert metrics._times[("scrobbles", "alice"), NETWORK] == 1
+    # the partition is inherited from the enclosing stage
+    assert metrics._times[("scrobbles", "alice"), DECODE] == 0.25
+
+
+def test_logs_intervals_and_summary(caplog):
+    clock = FakeClock()
+    logger = logging.getLogger("test-metrics")
+    metrics = Metrics(enabled=True, logger=logger, log_interval=10, clock=clock)
+    with caplog.at_level(logging.INFO, logger="test-metrics"):
+        metrics.count(RECORDS, 5, ("scrobbles", "alice"))
+        assert not caplog.messages
+        clock.now = 10
+        metrics.count(RECORDS, 2, ("scrobbles", "alice"))
+        assert caplog.messages == [
+            'METRIC: {"type": "counter", "metric": "records", "value": 7, '
+            '"tags": {"stream": "scrobbles", "username": "alice"}}'
+        ]
+        caplog.clear()
+        metrics.log_summary()
+    assert "Time spent on scrobbles[alice]: ; 7 records" in caplog.messages[0]
+
+
+def test_disabled_collects_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.timer(NETWORK, "scrobbles", "alice"):
+        metrics.count(RECORDS, 1, ("scrobbles", "alice"))
+    assert not metrics._times and not metrics._counts
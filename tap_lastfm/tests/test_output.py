@@ -0,0 +1,39 @@
+"""Tests of buffered Singer output."""
+
+import contextlib
+import io
+import json
+
+from singer import StateMessage
+
+from tap_lastfm.output import MessageWriter
+
+
+def test_writes_records_once_the_buffer_is_full():
+    output = io.StringIO()
+    writer = MessageWriter(buffer_bytes=200, clock=lambda: 0.5)
+    with contextlib.redirect_stdout(output):
+        writer.write_record("scrobbles", {"name": "Ünïcode"})
+        assert output.getvalue() == ""
+        for _ in range(3):
+            writer.write_record("scrobbles", {"name": "Track"})
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert messages[0] == {
+        "type": "RECORD",
+        "stream": "scrobbles",
+        "record": {"name": "Ünïcode"},
+        "time_extracted": "1970-01-01T00:00:00.000000Z",
+    }
+    assert len(messages) == 4
+
+
+def test_flush_writes_out_state():
+    output = io.StringIO()
+    writer = MessageWriter()
+    with contextlib.redirect_stdout(output):
+        writer.write_record("users", {"username": "a"})
+        writer.write_message(StateMessage(value={"bookmarks": {}}))
+        writer.flush()
+    lines = output.getvalue().splitlines()
+    assert json.loads(lines[-1]) == {"type": "STATE", "value": {"bookmarks": {}}}
+    assert len(lines) == 2
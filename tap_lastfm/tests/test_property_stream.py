@@ -0,0 +1,111 @@
+"""Tests for the declarative property mapping."""
+
+import pendulum
+import pytest
+from singer_sdk import typing as th
+from singer_sdk.helpers._typing import to_json_compatible
+
+from tap_lastfm.property_stream import (
+    Property,
+    compile_properties,
+    timestamp_to_rfc3339,
+)
+from tap_lastfm.streams import LovedTracksStream, ScrobblesStream, UsersStream
+from tap_lastfm.tap import TapLastFM
+from tap_lastfm.tests.samples import make_loved_track, make_track, make_user
+
+
+def read_all(properties: th.PropertiesList, row: dict) -> dict:
+    return {k: p.read_value(row) for k, p in properties.items()}
+
+
+def compile_all(properties: th.PropertiesList):
+    return compile_properties(p for _, p in properties.items())
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        make_track(1650000000),
+        make_track(1650000000, loved=True, album=""),
+        {
+            **make_track(1650000000),
+            "image": [
+                {"size": "small"},
+                {"size": "small", "#text": "first"},
+                {"size": "small", "#text": "second"},
+                {"#text": "no size"},
+                "not an object",
+                {"size": "large", "#text": "large"},
+                {"size": "medium", "#text": "medium"},
+                {"size": "extralarge", "#text": "xl"},
+            ],
+        },
+    ],
+)
+def test_compiled_scrobbles_match_jsonpath(row):
+    row = {**row, "username": "rabidaudio"}
+    properties = ScrobblesStream.properties
+    assert compile_all(properties)(row) == read_all(properties, row)
+    assert list(compile_all(properties)(row)) == list(read_all(properties, row))
+
+
+def test_compiled_users_match_jsonpath():
+    row = make_user("rabidaudio", playcount=1234)
+    properties = UsersStream.properties
+    assert compile_all(properties)(row) == read_all(properties, row)
+
+
+def test_compiled_loved_tracks_match_jsonpath():
+    row = {**make_loved_track(1650000000), "username": "rabidaudio"}
+    properties = LovedTracksStream.properties
+    assert compile_all(properties)(row) == read_all(properties, row)
+
+
+def test_missing_property_raises():
+    row = make_track(1650000000)
+    del row["artist"]["image"][2]["#text"]
+    row["username"] = "rabidaudio"
+    with pytest.raises(Exception, match="'large'"):
+        read_all(ScrobblesStream.properties, row)
+    with pytest.raises(Exception, match="'large'"):
+        ScrobblesStream._extract_record(row)
+
+
+def test_ignore_missing_and_fallback():
+    properties = [
+        Property("age", th.IntegerType, cast=int, ignore_missing=True),
+        Property(
+            "names",
+            th.ArrayType(th.StringType),
+            jsonpath_selector="$.people[*].name",
+        ),
+    ]
+    row = {"people": [{"name": "a"}, {"name": "b"}]}
+    assert compile_properties(properties)(row) == {"age": None, "names": ["a", "b"]}
+
+
+def test_selectors_are_compiled_once():
+    selector = "$.people[*].name"
+    a = Property("a", th.ArrayType(th.StringType), jsonpath_selector=selector)
+    b = Property("b", th.ArrayType(th.StringType), jsonpath_selector=selector)
+    assert a._selector is b._selector
+
+
+@pytest.mark.parametrize("slim", [False, True])
+def test_schema_is_built_once(slim):
+    tap = TapLastFM(
+        config={"api_key": "test", "usernames": ["test"], "slim_scrobbles": slim},
+        parse_env_config=False,
+    )
+    scrobbles = tap.streams["scrobbles"]
+    assert scrobbles.schema is scrobbles.schema
+    assert ("image" in scrobbles.schema["properties"]) is not slim
+    # each stream adjusts its own copy of the schema built for the class
+    assert "image" in ScrobblesStream._properties_schema["properties"]
+
+
+@pytest.mark.parametrize("timestamp", ["0", "951782400", "1650000000", 4102444799])
+def test_timestamp_cast_matches_sdk_output(timestamp):
+    expected = to_json_compatible(pendulum.from_timestamp(int(timestamp)))
+    assert timestamp_to_rfc3339(timestamp) == expected
@@ -0,0 +1,35 @@
+"""Tests for the client-side rate limiter."""
+
+from tap_lastfm.rate_limit import RateLimiter
+from tap_lastfm.tests.fake_clock import FakeClock
+
+
+def make_limiter(rate: float, burst: int) -> RateLimiter:
+    clock = FakeClock()
+    return RateLimiter(rate, burst=burst, clock=clock, sleep=clock.sleep)
+
+
+def test_allows_burst_then_limits_rate():
+    limiter = make_limiter(5, burst=5)
+    waits = [limiter.acquire() for _ in range(15)]
+    assert waits[:5] == [0] * 5
+    assert all(w > 0 for w in waits[5:])
+    assert limiter.achieved_rate() == 15 / 2.0
+
+
+def test_slows_down_when_throttled_and_recovers():
+    limiter = make_limiter(4, burst=1)
+    limiter.throttled()
+    assert limiter.rate == 2
+    limiter.acquire()
+    assert limiter.acquire() == 0.5
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.rate == 4
+
+
+def test_rate_never_drops_below_floor():
+    limiter = make_limiter(16, burst=1)
+    for _ in range(10):
+        limiter.throttled()
+    assert limiter.rate == 1
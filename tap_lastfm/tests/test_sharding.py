@@ -0,0 +1,58 @@
+"""Tests for splitting users between shards and merging their state."""
+
+import copy
+
+import pytest
+
+from tap_lastfm.sharding import filter_state, merge_states, select_shard, shard_of
+
+USERNAMES = [f"user{i}" for i in range(100)]
+
+
+def partition(username: str, bookmark: str) -> dict:
+    return {"context": {"username": username}, "replication_key_value": bookmark}
+
+
+def test_every_user_is_in_exactly_one_shard():
+    shards = [select_shard(USERNAMES, i, 3) for i in range(3)]
+    assert sorted(u for shard in shards for u in shard) == sorted(USERNAMES)
+    assert all(shards)
+    assert shard_of("Alice", 3) == shard_of("alice", 3)
+
+
+@pytest.mark.parametrize("shard_index,shard_count", [(2, 2), (-1, 2), (0, 0)])
+def test_invalid_shards_are_rejected(shard_index, shard_count):
+    with pytest.raises(ValueError, match="Invalid shard"):
+        select_shard(USERNAMES, shard_index, shard_count)
+
+
+def test_merged_states_can_be_filtered_back_into_shards():
+    states = [
+        {
+            "bookmarks": {
+                "users": {},
+                "scrobbles": {
+                    "partitions": [partition(u, f"bookmark {u}") for u in shard]
+                },
+            }
+        }
+        for shard in (select_shard(USERNAMES, i, 2) for i in range(2))
+    ]
+    merged = merge_states(states)
+    assert len(merged["bookmarks"]["scrobbles"]["partitions"]) == len(USERNAMES)
+    assert merged["bookmarks"]["users"] == {}
+
+    for shard_index, state in enumerate(states):
+        shard_state = copy.deepcopy(merged)
+        filter_state(shard_state, shard_index, 2)
+        assert shard_state == state
+
+
+def test_later_states_win_when_merging():
+    merged = merge_states(
+        [
+            {"bookmarks": {"scrobbles": {"partitions": [partition("a", "old")]}}},
+            {"bookmarks": {"scrobbles": {"partitions": [partition("a", "new")]}}},
+        ]
+    )
+    assert merged["bookmarks"]["scrobbles"]["partitions"] == [partition("a", "new")]
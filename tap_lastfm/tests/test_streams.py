@@ -0,0 +1,47 @@
+"""Tests for how the scrobbles stream splits a user's history into windows."""
+
+from tap_lastfm.streams import MAX_WINDOW_SECONDS, MIN_WINDOW_SECONDS, ScrobblesStream
+from tap_lastfm.tap import TapLastFM
+
+DAY = 24 * 60 * 60
+
+
+def scrobbles_stream(**config) -> ScrobblesStream:
+    tap = TapLastFM(
+        config={"api_key": "test", "usernames": ["alice"], **config},
+        parse_env_config=False,
+    )
+    stream = tap.streams["scrobbles"]
+    assert isinstance(stream, ScrobblesStream)
+    return stream
+
+
+def window(start: int, days: float) -> dict:
+    return {"from": str(start), "to": str(int(start + days * DAY)), "page": 1}
+
+
+def test_resumed_window_is_sized_from_the_part_requested():
+    stream = scrobbles_stream(target_pages_per_window=2)
+    full = window(0, 40)
+    # resumed with only its oldest 10 days left to request, holding 400 scrobbles
+    resumed = window(0, 10)
+    assert stream._next_window_seconds(full, 400, resumed) == 10 * DAY
+    # had the whole window been counted, it would have seemed four times sparser
+    assert stream._next_window_seconds(full, 400) == 40 * DAY
+
+
+def test_windows_are_sized_to_hold_the_target_number_of_pages():
+    stream = scrobbles_stream(target_pages_per_window=2)
+    # 400 scrobbles fit in two pages
+    assert stream._next_window_seconds(window(0, 40), 800) == 20 * DAY
+    # but windows grow or shrink at most four times over at once
+    assert stream._next_window_seconds(window(0, 10), 10) == 40 * DAY
+    assert stream._next_window_seconds(window(0, 40), 40_000) == 10 * DAY
+    # and grow as fast as they can through windows without any scrobbles
+    assert stream._next_window_seconds(window(0, 10), 0) == 40 * DAY
+
+
+def test_window_sizes_are_bounded():
+    stream = scrobbles_stream(target_pages_per_window=2)
+    assert stream._next_window_seconds(window(0, 1 / 12), 4000) == MIN_WINDOW_SECONDS
+    assert stream._next_window_seconds(window(0, 5 * 365), 0) == MAX_WINDOW_SECONDS
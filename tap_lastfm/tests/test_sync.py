@@ -0,0 +1,533 @@
+"""End-to-end tests of syncing from a local fake Last.fm API."""
+
+import contextlib
+import io
+import json
+import math
+import threading
+from typing import Iterator, List, Optional
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import backoff
+import pendulum
+import pytest
+
+from tap_lastfm.client import LastFMAPIError, LastFMStream
+from tap_lastfm.sharding import merge_states
+from tap_lastfm.streams import LovedTracksStream, ScrobblesStream
+from tap_lastfm.tap import TapLastFM
+from tap_lastfm.tests.fake_lastfm import FakeLastFM
+
+USERNAMES = ["alice", "bob"]
+
+
+@pytest.fixture
+def fake_api():
+    fake = FakeLastFM(USERNAMES, scrobbles=700, history_days=90, error_rate=0.3)
+    fake.start()
+    # retry failures straight away, and enough times to never give up
+    with mock.patch.object(LastFMStream, "url_base", fake.url), mock.patch.object(
+        LastFMStream, "backoff_wait_generator", lambda self: backoff.constant(0)
+    ), mock.patch.object(LastFMStream, "backoff_max_tries", lambda self: 20):
+        yield fake
+    fake.stop()
+
+
+def sync(
+    config: dict, state: Optional[dict] = None, output: Optional[io.StringIO] = None
+) -> List[dict]:
+    tap = TapLastFM(
+        config={
+            "api_key": "test",
+            "usernames": USERNAMES,
+            "requests_per_second": 1000,
+            **config,
+        },
+        state=state,
+        parse_env_config=False,
+    )
+    output = output or io.StringIO()
+    with contextlib.redirect_stdout(output):
+        tap.sync_all()
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+@contextlib.contextmanager
+def recorded_requests(fake: FakeLastFM) -> Iterator[List[dict]]:
+    """Record the params of each request the fake API answers."""
+    respond = fake.respond
+    recorded: List[dict] = []
+
+    def record(path: str) -> tuple:
+        recorded.append({k: v[0] for k, v in parse_qs(urlparse(path).query).items()})
+        return respond(path)
+
+    with mock.patch.object(fake, "respond", record):
+        yield recorded
+
+
+def recent_tracks_requests(recorded: List[dict]) -> List[dict]:
+    return [r for r in recorded if r["method"].lower() == "user.getrecenttracks"]
+
+
+def scrobble_names(messages: List[dict]) -> List[str]:
+    return [
+        m["record"]["name"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {},
+        {"max_concurrent_users": 2, "max_concurrent_pages": 3},
+        {"sorted_scrobbles": True, "max_concurrent_pages": 3},
+    ],
+    ids=["serial", "concurrent", "sorted"],
+)
+def test_syncs_every_scrobble_once(fake_api, config):
+    messages = sync({"step_days": 30, **config})
+
+    records = [m for m in messages if m["type"] == "RECORD"]
+    users = [m["record"]["username"] for m in records if m["stream"] == "users"]
+    assert users == USERNAMES
+    scrobbles = [m["record"] for m in records if m["stream"] == "scrobbles"]
+    for username in USERNAMES:
+        names = [s["name"] for s in scrobbles if s["username"] == username]
+        assert sorted(names) == sorted(f"Track {i}" for i in range(700))
+        if config.get("sorted_scrobbles"):
+            assert names == [f"Track {i}" for i in range(700)]
+
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    partitions = state["bookmarks"]["scrobbles"]["partitions"]
+    assert {p["context"]["username"] for p in partitions} == set(USERNAMES)
+    for partition in partitions:
+        dates = [
+            s["date"]
+            for s in scrobbles
+            if s["username"] == partition["context"]["username"]
+        ]
+        assert partition["replication_key_value"] == max(dates)
+    assert fake_api.error_count > 0
+
+
+def test_stops_page_workers_at_the_end_of_the_sync(fake_api):
+    sync({"max_concurrent_pages": 3})
+    assert not [
+        t for t in threading.enumerate() if t.name.startswith("tap-lastfm-pages")
+    ]
+
+
+def test_writes_each_artist_and_album_once(fake_api):
+    messages = sync({"slim_scrobbles": True})
+
+    records = [m for m in messages if m["type"] == "RECORD"]
+    artists = [m["record"]["name"] for m in records if m["stream"] == "artists"]
+    assert sorted(artists) == sorted(f"Artist {i}" for i in range(97))
+    albums = [m["record"] for m in records if m["stream"] == "albums"]
+    assert len(albums) == 97
+    assert albums[0]["image"]["small"].endswith("/small.png")
+    scrobble = next(m["record"] for m in records if m["stream"] == "scrobbles")
+    assert set(scrobble["artist"]) == {"name", "mbid"}
+    assert "image" not in scrobble
+
+
+@pytest.mark.parametrize("config", [{}, {"slim_scrobbles": True}], ids=["", "slim"])
+def test_fast_output_matches_sdk_output(fake_api, config):
+    def strip(messages):
+        # the SDK's time_extracted has microseconds, fast_output's only seconds,
+        # and state holds the time of each sync
+        return [
+            m["type"]
+            if m["type"] == "STATE"
+            else {k: v for k, v in m.items() if k != "time_extracted"}
+            for m in messages
+        ]
+
+    expected = strip(sync(config))
+    assert strip(sync({"fast_output": True, **config})) == expected
+
+
+def test_caught_up_users_cost_one_request(fake_api):
+    messages = sync({})
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    # pretend the last day's scrobbles were not synced yet
+    since = {}
+    for partition in state["bookmarks"]["scrobbles"]["partitions"]:
+        bookmark = pendulum.parse(partition["replication_key_value"]).subtract(days=1)
+        partition["replication_key_value"] = bookmark.isoformat()
+        del partition["playcount"]
+        since[partition["context"]["username"]] = bookmark
+
+    fake_api.error_rate = 0
+    requests_before = fake_api.request_count
+    messages = sync({}, state)
+
+    # one request for each user's info and one for their new scrobbles, and a
+    # probe each of their loved tracks and friends
+    assert fake_api.request_count - requests_before == 4 * len(USERNAMES)
+    scrobbles = [
+        m["record"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    for username in USERNAMES:
+        dates = [s["date"] for s in scrobbles if s["username"] == username]
+        expected = [
+            fake_api.scrobble_time(i)
+            for i in range(fake_api.scrobbles)
+            if fake_api.scrobble_time(i) > since[username].int_timestamp
+        ]
+        assert sorted(pendulum.parse(d).int_timestamp for d in dates) == expected
+
+    # and nothing is written again when there are no new scrobbles
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    messages = sync({"skip_unchanged_users": False}, state)
+    assert not [m for m in messages if m.get("stream") == "scrobbles" and "record" in m]
+
+
+def test_skips_users_whose_playcount_is_unchanged(fake_api):
+    messages = sync({})
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+
+    fake_api.error_rate = 0
+    requests_before = fake_api.request_count
+    messages = sync({"max_concurrent_users": 2}, state)
+
+    # only each user's info is requested, and their loved tracks and friends probed
+    assert fake_api.request_count - requests_before == 3 * len(USERNAMES)
+    assert not [m for m in messages if m.get("stream") == "scrobbles" and "record" in m]
+    assert [m for m in messages if m["type"] == "STATE"][-1]["value"] == state
+
+
+def test_skips_unknown_users(fake_api):
+    messages = sync({"usernames": ["bob", "nobody", "alice"]})
+
+    records = [m for m in messages if m["type"] == "RECORD"]
+    users = [m["record"]["username"] for m in records if m["stream"] == "users"]
+    assert users == ["bob", "alice"]
+    scrobblers = {
+        m["record"]["username"] for m in records if m["stream"] == "scrobbles"
+    }
+    assert scrobblers == {"bob", "alice"}
+
+
+def test_loved_tracks_and_friends_are_requested_when_they_change(fake_api):
+    def records(messages: List[dict], stream: str) -> List[dict]:
+        return [
+            m["record"]
+            for m in messages
+            if m["type"] == "RECORD" and m["stream"] == stream
+        ]
+
+    fake_api.error_rate = 0
+    fake_api.loved = 120
+    fake_api.friends = 3
+    config = {"usernames": ["alice"]}
+    with mock.patch.object(LovedTracksStream, "page_size", 50):
+        messages = sync(config)
+        loved = records(messages, "loved_tracks")
+        assert [r["name"] for r in loved] == [f"Track {i}" for i in range(119, -1, -1)]
+        assert records(messages, "friends") == [
+            {"username": "alice", "friend_username": f"friend{i}"} for i in range(3)
+        ]
+
+        state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+        requests_before = fake_api.request_count
+        messages = sync(config, state)
+        # the user's info, and a probe each of their loved tracks and friends
+        assert fake_api.request_count - requests_before == 3
+        assert not records(messages, "loved_tracks")
+        assert not records(messages, "friends")
+
+        fake_api.loved = 125
+        fake_api.friends = 4
+        state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+        requests_before = fake_api.request_count
+        messages = sync(config, state)
+        # only the first page of loved tracks has any new ones
+        assert fake_api.request_count - requests_before == 5
+        loved = records(messages, "loved_tracks")
+        assert [r["name"] for r in loved] == [f"Track {i}" for i in range(124, 119, -1)]
+        assert len(records(messages, "friends")) == 4
+
+
+def test_spreads_requests_across_api_keys(fake_api):
+    fake_api.invalid_keys = {"test"}
+    messages = sync({"api_keys": ["key-a", "key-b"], "max_concurrent_pages": 3})
+
+    scrobbles = [
+        m for m in messages if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    assert len(scrobbles) == 700 * len(USERNAMES)
+    # the invalid key is benched once it has been rejected
+    assert fake_api.key_counts["test"] <= 4
+    assert fake_api.key_counts["key-a"] >= 3
+    assert fake_api.key_counts["key-b"] >= 3
+
+
+def test_fails_once_every_api_key_is_rejected(fake_api):
+    fake_api.invalid_keys = {"test", "key-a"}
+    with pytest.raises(LastFMAPIError, match="Last.fm error 10"):
+        sync({"api_keys": ["key-a"]})
+
+
+@pytest.mark.parametrize("code", [8, 11, 16])
+def test_retries_transient_errors(fake_api, code):
+    fake_api.error_rate = 0
+    respond = fake_api.respond
+    failed = []
+
+    def fail_once(path: str) -> tuple:
+        if "getrecenttracks" in path.lower() and not failed:
+            failed.append(path)
+            return 400, {"error": code, "message": "Try again later"}
+        return respond(path)
+
+    with mock.patch.object(fake_api, "respond", fail_once):
+        messages = sync({})
+    assert failed
+    for username in USERNAMES:
+        names = [
+            m["record"]["name"]
+            for m in messages
+            if m["type"] == "RECORD"
+            and m["stream"] == "scrobbles"
+            and m["record"]["username"] == username
+        ]
+        assert sorted(names) == sorted(f"Track {i}" for i in range(700))
+
+
+def test_shards_split_users_and_their_state(fake_api):
+    states = []
+    for shard_index in range(2):
+        messages = sync({"shard_index": shard_index, "shard_count": 2})
+        states.append([m for m in messages if m["type"] == "STATE"][-1]["value"])
+    partitions = [s["bookmarks"]["scrobbles"]["partitions"] for s in states]
+    assert [[p["context"]["username"] for p in ps] for ps in partitions] == [
+        ["bob"],
+        ["alice"],
+    ]
+
+    merged = merge_states(states)
+    assert merged["bookmarks"]["scrobbles"]["partitions"] == partitions[0] + (
+        partitions[1]
+    )
+
+    # each shard picks up its own users from the merged state
+    fake_api.error_rate = 0
+    requests_before = fake_api.request_count
+    messages = sync({"shard_index": 0, "shard_count": 2}, merged)
+    assert fake_api.request_count - requests_before == 3
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    assert state["bookmarks"]["scrobbles"]["partitions"] == partitions[0]
+
+
+@pytest.mark.parametrize(
+    "config", [{}, {"sorted_scrobbles": True}], ids=["newest_first", "sorted"]
+)
+def test_skips_scrobbles_written_at_the_bookmark(fake_api, config):
+    messages = sync(config)
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    for partition in state["bookmarks"]["scrobbles"]["partitions"]:
+        bookmark = pendulum.parse(partition["replication_key_value"])
+        assert partition["written"] == {
+            "uts": bookmark.int_timestamp,
+            "names": [f"Track {fake_api.scrobbles - 1}"],
+        }
+
+    # request a whole window from the bookmark, which includes its scrobble
+    fake_api.error_rate = 0
+    with mock.patch.object(ScrobblesStream, "_is_caught_up", return_value=False):
+        messages = sync({"skip_unchanged_users": False, **config}, state)
+    assert not [m for m in messages if m.get("stream") == "scrobbles" and "record" in m]
+    assert [m for m in messages if m["type"] == "STATE"][-1]["value"] == state
+
+
+@pytest.mark.parametrize(
+    "config", [{}, {"sorted_scrobbles": True}], ids=["newest_first", "sorted"]
+)
+def test_writes_scrobbles_at_a_window_boundary_once(fake_api, config):
+    # three scrobbles at the end of the first window, which is the start of
+    # the second, among a scrobble a day
+    day = 24 * 60 * 60
+    boundary = fake_api.registered + 30 * day
+    fake_api.set_scrobble_times(
+        [fake_api.registered + i * day for i in range(1, 90) if i != 30]
+        + [boundary] * 3
+    )
+    messages = sync({"step_days": 30, **config})
+
+    for username in USERNAMES:
+        names = [
+            m["record"]["name"]
+            for m in messages
+            if m["type"] == "RECORD"
+            and m["stream"] == "scrobbles"
+            and m["record"]["username"] == username
+        ]
+        assert sorted(names) == sorted(f"Track {i}" for i in range(91))
+
+
+@pytest.mark.parametrize(
+    "resumed_config, requests",
+    [({}, 5), ({"sorted_scrobbles": True}, 6)],
+    ids=["newest_first", "sorted"],
+)
+def test_resumes_an_interrupted_window(fake_api, resumed_config, requests):
+    fake_api.error_rate = 0
+    # a single window of four pages
+    config = {"usernames": ["alice"], "step_days": 120}
+    respond = fake_api.respond
+    pages = []
+
+    def fail_third_page(path: str) -> tuple:
+        if "getrecenttracks" in path.lower():
+            pages.append(path)
+            if len(pages) == 3:
+                return 400, {"error": 7, "message": "Invalid resource specified"}
+        return respond(path)
+
+    output = io.StringIO()
+    with mock.patch.object(fake_api, "respond", fail_third_page):
+        with pytest.raises(LastFMAPIError):
+            sync(config, output=output)
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    written = [
+        m["record"]["date"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    assert len(written) == 2 * 200
+    (partition,) = state["bookmarks"]["scrobbles"]["partitions"]
+    assert partition["resume"]["before"] == min(
+        str(pendulum.parse(d).int_timestamp) for d in written
+    )
+
+    requests_before = fake_api.request_count
+    messages = sync({**config, **resumed_config}, state)
+    # the user's info, then the two pages not written yet, and a probe each of
+    # their loved tracks and friends; oldest first, the window after the
+    # newest scrobble written is requested too
+    assert fake_api.request_count - requests_before == requests
+    resumed = [
+        m["record"]["date"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    if resumed_config.get("sorted_scrobbles"):
+        assert resumed == sorted(resumed)
+    written += resumed
+    expected = [fake_api.scrobble_time(i) for i in range(fake_api.scrobbles)]
+    assert sorted(pendulum.parse(d).int_timestamp for d in written) == expected
+
+    (partition,) = [m for m in messages if m["type"] == "STATE"][-1]["value"][
+        "bookmarks"
+    ]["scrobbles"]["partitions"]
+    assert "resume" not in partition
+    assert partition["replication_key_value"] == max(written)
+
+
+def fake_api_date(fake_api: FakeLastFM, index: int) -> str:
+    return pendulum.from_timestamp(fake_api.scrobble_time(index)).isoformat()
+
+
+def test_sorted_scrobbles_resume_from_the_bookmark(fake_api):
+    fake_api.error_rate = 0
+    config = {"usernames": ["alice"], "step_days": 120, "sorted_scrobbles": True}
+    respond = fake_api.respond
+    pages = []
+
+    def fail_third_page(path: str) -> tuple:
+        if "getrecenttracks" in path.lower():
+            pages.append(path)
+            if len(pages) == 3:
+                return 400, {"error": 7, "message": "Invalid resource specified"}
+        return respond(path)
+
+    output = io.StringIO()
+    with mock.patch.object(fake_api, "respond", fail_third_page):
+        with pytest.raises(LastFMAPIError):
+            sync(config, output=output)
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    names = [
+        m["record"]["name"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    # the first page is requested to count the pages, then the last, with the
+    # oldest hundred, before the third page fails
+    assert names == [f"Track {i}" for i in range(100)]
+
+    # the bookmark is written after every page
+    state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+    (partition,) = state["bookmarks"]["scrobbles"]["partitions"]
+    assert partition["replication_key_value"] == fake_api_date(fake_api, 99)
+
+    messages = sync(config, state)
+    names += [
+        m["record"]["name"]
+        for m in messages
+        if m["type"] == "RECORD" and m["stream"] == "scrobbles"
+    ]
+    assert names == [f"Track {i}" for i in range(700)]
+
+
+def test_sparse_users_need_fewer_windows_with_target_pages_per_window(fake_api):
+    # twenty scrobbles over two years
+    fake_api.error_rate = 0
+    fake_api.scrobbles = 20
+    fake_api.registered = fake_api.now - 720 * 24 * 60 * 60
+    config = {"usernames": ["alice"], "step_days": 30}
+
+    with recorded_requests(fake_api) as fixed:
+        names = scrobble_names(sync(config))
+    assert sorted(names) == sorted(f"Track {i}" for i in range(20))
+
+    with recorded_requests(fake_api) as adaptive:
+        names = scrobble_names(sync({**config, "target_pages_per_window": 1}))
+    assert sorted(names) == sorted(f"Track {i}" for i in range(20))
+
+    # a window for every 30 days up to now, against a window of 30 days and then
+    # windows growing four times over
+    assert len(recent_tracks_requests(fixed)) == 25
+    assert len(recent_tracks_requests(adaptive)) == 4
+
+
+def test_probe_history_skips_to_the_first_scrobble(fake_api):
+    # a user who registered 1920 days ago, but only scrobbled in the last 60
+    fake_api.error_rate = 0
+    day = 24 * 60 * 60
+    history_days = 1920
+    fake_api.registered = fake_api.now - history_days * day
+    first = fake_api.now - 60 * day
+    fake_api.set_scrobble_times(first + i * day // 2 for i in range(100))
+    config = {"usernames": ["alice"], "step_days": 30, "probe_history": True}
+
+    with recorded_requests(fake_api) as recorded:
+        names = scrobble_names(sync(config))
+    assert sorted(names) == sorted(f"Track {i}" for i in range(100))
+
+    requests = recent_tracks_requests(recorded)
+    probes = [r for r in requests if r["limit"] == "1"]
+    windows = [r for r in requests if r["limit"] != "1"]
+    # one probe of the whole history, then a bisection down to a window
+    assert len(probes) == 1 + math.ceil(math.log2(history_days / 30))
+    assert first - 30 * day <= int(windows[0]["from"]) <= first
+    # the windows cover the 60 days of scrobbles, rather than the whole history
+    assert len(windows) <= 4
+
+
+def test_probe_history_costs_one_request_without_scrobbles(fake_api):
+    fake_api.error_rate = 0
+    fake_api.set_scrobble_times([])
+    config = {"usernames": ["alice"], "probe_history": True}
+
+    with recorded_requests(fake_api) as recorded:
+        assert not scrobble_names(sync(config))
+    (probe,) = recent_tracks_requests(recorded)
+    assert probe["limit"] == "1"
@@ -0,0 +1,40 @@
+"""Tests for the pooled HTTP session."""
+
+import logging
+
+from tap_lastfm.tests.fake_lastfm import FakeLastFM
+from tap_lastfm.transport import PooledSession
+
+
+def test_reuses_connections_and_compresses():
+    fake = FakeLastFM(["alice"]).start()
+    try:
+        session = PooledSession(pool_size=2)
+        for _ in range(5):
+            response = session.get(
+                f"{fake.url}/2.0",
+                params={"method": "user.getinfo", "user": "alice", "format": "json"},
+            )
+            assert response.json()["user"]["name"] == "alice"
+    finally:
+        fake.stop()
+
+    assert session.connection_counts() == (5, 1)
+    assert (session.compressed_count, session.uncompressed_count) == (5, 0)
+
+
+def test_logs_uncompressed_responses_without_the_api_key(caplog):
+    fake = FakeLastFM(["alice"]).start()
+    try:
+        session = PooledSession(pool_size=1, logger=logging.getLogger("test"))
+        session.get(
+            f"{fake.url}/2.0",
+            params={"method": "user.getinfo", "user": "alice", "api_key": "secret"},
+            headers={"Accept-Encoding": "identity"},
+        )
+    finally:
+        fake.stop()
+
+    assert session.uncompressed_count == 1
+    assert f"Response from {fake.url}/2.0 was not compressed" in caplog.text
+    assert "secret" not in caplog.text
@@ -0,0 +1,71 @@
+"""The HTTP session requests to the Last.fm API are sent with."""
+
+import logging
+import threading
+from typing import Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+COMPRESSED_ENCODINGS = {"gzip", "deflate"}
+
+
+class PooledSession(requests.Session):
+    """A session keeping enough connections alive for every worker thread.
+
+    Responses are requested compressed, and how many actually were is
+    counted along with how often connections were reused.
+    """
+
+    def __init__(self, pool_size: int, logger: Optional[logging.Logger] = None):
+        """Create a session keeping up to `pool_size` connections per host."""
+        super().__init__()
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount("https://", self.adapter)
+        self.mount("http://", self.adapter)
+        self.headers["Accept-Encoding"] = ", ".join(sorted(COMPRESSED_ENCODINGS))
+        self.compressed_count = 0
+        self.uncompressed_count = 0
+        self._logger = logger
+        self._lock = threading.Lock()
+        self.hooks["response"].append(self._count_encoding)
+
+    def connection_counts(self) -> Tuple[int, int]:
+        """Return the numbers of requests sent and connections opened."""
+        pools = self.adapter.poolmanager.pools
+        requests_sent = connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        return requests_sent, connections
+
+    def log_summary(self) -> None:
+        """Report how well connections were reused and responses compressed."""
+        if not self._logger:
+            return
+        requests_sent, connections = self.connection_counts()
+        self._logger.info(
+            f"Sent {requests_sent} requests over {connections} connections "
+            f"({max(0, requests_sent - connections)} reused a pooled connection); "
+            f"{self.compressed_count} responses were compressed, "
+            f"{self.uncompressed_count} were not"
+        )
+
+    def _count_encoding(self, response: requests.Response, **kwargs: Any) -> None:
+        encoding = response.headers.get("Content-Encoding", "").lower()
+        with self._lock:
+            if encoding in COMPRESSED_ENCODINGS:
+                self.compressed_count += 1
+                return
+            self.uncompressed_count += 1
+            first = self.uncompressed_count == 1
+        if first and self._logger:
+            # the query holds the API key
+            url = urlsplit(response.url)
+            self._logger.warning(
+                f"Response from {url.scheme}://{url.netloc}{url.path} was not "
+                "compressed, despite asking for gzip or deflate"
+            )